@@ -0,0 +1,104 @@
+import importlib.util
+import os
+import sys
+import time
+import zlib
+
+# the server script is loaded as a module, its file name does not allow a plain import
+spec = importlib.util.spec_from_file_location('stap_server', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stap-server.py'))
+stap = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(stap)
+
+class BenchmarkServer(stap.STAPServerMixIn):
+    # server state without any listening socket, the scheduler is never run
+    def __init__(self):
+        self.init_state()
+
+class BenchmarkHandler(stap.STAPProtocol):
+    # client connection without any transport, the output is counted and discarded
+    def __init__(self, server = None):
+        self.client_address = ('benchmark', 0)
+        self.server = server if server != None else BenchmarkServer()
+        self.scheduler = self.server.scheduler
+        self.written = 0
+        self.lines = 0
+        self.open_session()
+
+    def send(self, data, droppable):
+        self.written += len(data)
+        self.lines += data.count(b'\n')
+
+def bench_generation(crc32, duration, clients = 1):
+    # all labels of an ARINC 429 receiver and all words of an ARINC 717 receiver, subscribed by all the clients
+    server = BenchmarkServer()
+    handlers = [BenchmarkHandler(server) for i in range(clients)]
+    for handler in handlers:
+        handler.handle_request(b'add,0,all')
+        handler.handle_request(b'add,21,all,all')
+        handler.crc32 = crc32
+    topics = list(server.topics.values())
+
+    deadline = 0.0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        for topic in topics:
+            topic.fire(deadline, deadline)
+            topic.flush()
+        deadline += 1.0
+    elapsed = time.perf_counter() - start
+    return sum(handler.lines for handler in handlers) / elapsed, sum(handler.written for handler in handlers) / elapsed
+
+def bench_fanout(crc32, duration):
+    # the same data delivered to many clients
+    return bench_generation(crc32, duration, 100)
+
+def bench_requests(crc32, duration):
+    # pipelined subscriptions and removals of a single label, with checksums if enabled
+    handler = BenchmarkHandler()
+    handler.crc32 = crc32
+    chunk = b''
+    for request in [b'add,0,100', b'remove,0,100'] * 20:
+        if crc32:
+            request += b',%08x' % zlib.crc32(request + b',')
+        chunk += request + b'\r\n'
+
+    lines = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        handler.process_input(chunk)
+        lines += 40
+    elapsed = time.perf_counter() - start
+    return lines / elapsed, handler.written / elapsed
+
+def bench_transmitex(crc32, duration):
+    # bulk transmissions of the maximal number of words
+    stap.GLOBAL_CONFIG['max_input_buffer'] = 65536
+    handler = BenchmarkHandler()
+    handler.crc32 = crc32
+    total_words = stap.GLOBAL_CONFIG['max_transmitex_words']
+    request = b'transmitex,10,%d' % total_words
+    for i in range(total_words):
+        request += b',%o,%06x' % (i % 256, (i * 0x1357) & 0x7fffff)
+    if crc32:
+        request += b',%08x' % zlib.crc32(request + b',')
+    chunk = request + b'\r\n'
+    transmitter = handler.server.get_transmitter(10)
+
+    lines = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        handler.process_input(chunk)
+        # the bus is far slower than the request processing, the sent words are dropped to measure the requests only
+        transmitter.queue.clear()
+        lines += 1
+    elapsed = time.perf_counter() - start
+    return lines / elapsed, handler.written / elapsed
+
+if __name__ == "__main__":
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+
+    print('{:<12} {:<6} {:>14} {:>14}'.format('benchmark', 'crc32', 'lines/s', 'MB/s'))
+    for name, bench in [('generation', bench_generation), ('fanout', bench_fanout), ('requests', bench_requests), ('transmitex', bench_transmitex)]:
+        for crc32 in [False, True]:
+            lines, written = bench(crc32, duration)
+            print('{:<12} {:<6} {:>14.0f} {:>14.2f}'.format(name, 'on' if crc32 else 'off', lines, written / 1e6))
@@ -0,0 +1,242 @@
+import argparse
+import asyncio
+import collections
+import importlib.util
+import json
+import os
+import random
+import re
+import time
+import zlib
+
+# the server script is loaded as a module for its latency histograms, its file name does not allow a plain import
+spec = importlib.util.spec_from_file_location('stap_server', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stap-server.py'))
+stap = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(stap)
+
+class LoadResults():
+    # results of all the clients of a scenario, the clients share one event loop
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.latency = stap.Histogram()
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.disconnects = 0
+        self.data_lines = 0
+        self.received = 0
+        self.start = time.perf_counter()
+
+    def report(self, scenario, args):
+        elapsed = time.perf_counter() - self.start
+        return { \
+            'scenario': scenario, \
+            'clients': args.clients, \
+            'crc32': args.crc32, \
+            'duration': elapsed, \
+            'requests': self.requests, \
+            'requests_per_second': self.requests / elapsed, \
+            'errors': self.errors, \
+            'timeouts': self.timeouts, \
+            'disconnects': self.disconnects, \
+            'latency_us': { \
+                'mean': self.latency.total / self.latency.count * 1e6 if self.latency.count > 0 else 0, \
+                'p50': self.latency.get_quantile(0.5), \
+                'p90': self.latency.get_quantile(0.9), \
+                'p99': self.latency.get_quantile(0.99), \
+                'p999': self.latency.get_quantile(0.999), \
+                'max': self.latency.max }, \
+            'data_lines': self.data_lines, \
+            'data_lines_per_second': self.data_lines / elapsed, \
+            'received_bytes_per_second': self.received / elapsed }
+
+class LoadClient():
+    # connection to the server, the requests are written pipelined and matched with their responses in order,
+    # the data lines in between are only counted
+    # (the responses are found by a single scan of the received chunk, the data lines never reach the interpreter one by one)
+    response = re.compile(rb'^(?!data,)([^\r\n]+)', re.M)
+
+    def __init__(self, results, args):
+        self.results = results
+        self.args = args
+        self.crc32 = False
+        self.pending = collections.deque()
+        self.buffer = b''
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        self.reader_task = asyncio.get_running_loop().create_task(self.read())
+        if self.args.crc32:
+            await self.request([b'checksum,crc32,on'])
+            self.crc32 = True
+
+    def close(self):
+        self.reader_task.cancel()
+        self.writer.close()
+
+    def encode(self, request):
+        if self.crc32:
+            return request + b',%08x\r\n' % zlib.crc32(request + b',')
+        return request + b'\r\n'
+
+    async def request(self, requests):
+        # sends the requests at once, returns their responses
+        loop = asyncio.get_running_loop()
+        sent = time.perf_counter()
+        futures = []
+        for request in requests:
+            future = loop.create_future()
+            self.pending.append((sent, future))
+            futures.append(future)
+        self.writer.write(b''.join([self.encode(request) for request in requests]))
+        await self.writer.drain()
+        return await asyncio.wait_for(asyncio.gather(*futures), self.args.timeout)
+
+    async def read(self):
+        while True:
+            received = await self.reader.read(262144)
+            if len(received) == 0:
+                for sent, future in self.pending:
+                    if not future.done():
+                        future.set_exception(ConnectionError('Connection closed by the server'))
+                return
+
+            self.results.received += len(received)
+            buffer = self.buffer + received
+            end = buffer.rfind(b'\n') + 1
+            complete = buffer[:end]
+            self.buffer = buffer[end:]
+            self.results.data_lines += complete.count(b'data,')
+
+            now = time.perf_counter()
+            for match in LoadClient.response.finditer(complete):
+                if len(self.pending) == 0:
+                    continue
+                sent, future = self.pending.popleft()
+                self.results.latency.record(now - sent)
+                self.results.requests += 1
+                if match.group(1).startswith(b'err'):
+                    self.results.errors += 1
+                if not future.done():
+                    future.set_result(match.group(1))
+
+class SubscribeAll():
+    # many clients receiving all the labels of an ARINC 429 receiver and all the words of an ARINC 717 receiver,
+    # the request latency under this load is probed by status requests
+    def __init__(self, args, index):
+        self.args = args
+
+    async def setup(self, client):
+        await client.request([b'add,0,all,%d' % self.args.frequency, b'add,21,all,all'])
+
+    async def step(self, client):
+        await client.request([b'status'])
+        await asyncio.sleep(0.1)
+
+class TransmitexBursts():
+    # bulk transmissions of the maximal number of words, the server needs a max_input_buffer of at least 16384 bytes
+    def __init__(self, args, index):
+        request = b'transmitex,10,%d' % args.words
+        for i in range(args.words):
+            request += b',%o,%06x' % (i % 256, (i * 0x1357) & 0x7fffff)
+        self.request = request
+
+    async def setup(self, client):
+        pass
+
+    async def step(self, client):
+        await client.request([self.request])
+
+class PipelinedFlood():
+    # subscriptions and removals of a single label, as many pipelined as the depth
+    def __init__(self, args, index):
+        self.requests = [b'add,0,%o' % (index % 256), b'remove,0,%o' % (index % 256)] * (args.depth // 2)
+
+    async def setup(self, client):
+        pass
+
+    async def step(self, client):
+        await client.request(self.requests)
+
+class CommandMix():
+    # random mix of subscriptions, removals, status requests and small transmissions, reproducible by the seed
+    def __init__(self, args, index):
+        self.random = random.Random(args.seed + index)
+        self.labels = set()
+
+    async def setup(self, client):
+        pass
+
+    async def step(self, client):
+        choice = self.random.random()
+        if choice < 0.4:
+            label = self.random.randrange(256)
+            if label in self.labels:
+                self.labels.discard(label)
+                await client.request([b'remove,0,%o' % label])
+            else:
+                self.labels.add(label)
+                await client.request([b'add,0,%o,%d' % (label, self.random.choice([5, 10, 50, 100]))])
+        elif choice < 0.7:
+            await client.request([b'status'])
+        else:
+            words = self.random.randint(1, 16)
+            request = b'transmitex,10,%d' % words
+            for i in range(words):
+                request += b',%o,%06x' % (self.random.randrange(256), self.random.randrange(0x800000))
+            await client.request([request])
+
+SCENARIOS = { \
+    'subscribe-all': SubscribeAll, \
+    'transmitex': TransmitexBursts, \
+    'flood': PipelinedFlood, \
+    'mix': CommandMix }
+
+async def run_client(scenario, client, results, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            await scenario.step(client)
+        except asyncio.TimeoutError:
+            results.timeouts += 1
+            return
+        except ConnectionError:
+            results.disconnects += 1
+            return
+
+async def run_scenario(name, args):
+    # all the clients are connected and set up first, the measurement starts afterwards
+    results = LoadResults()
+    clients = [LoadClient(results, args) for i in range(args.clients)]
+    scenarios = [SCENARIOS[name](args, i) for i in range(args.clients)]
+    try:
+        await asyncio.gather(*[client.connect() for client in clients])
+        await asyncio.gather(*[scenario.setup(client) for scenario, client in zip(scenarios, clients)])
+        results.reset()
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(*[run_client(scenario, client, results, deadline) for scenario, client in zip(scenarios, clients)])
+        return results.report(name, args)
+    finally:
+        for client in clients:
+            if hasattr(client, 'writer'):
+                client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load generator of STAP servers, prints the results as JSON.')
+    parser.add_argument('scenario', choices=list(SCENARIOS) + ['all'], help='scenario to run, all runs each of them')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=50600)
+    parser.add_argument('--clients', type=int, default=10, help='number of concurrent connections')
+    parser.add_argument('--duration', type=float, default=10.0, help='measured time in seconds, after the setup of the clients')
+    parser.add_argument('--crc32', action='store_true', help='switch the CRC32 mode on')
+    parser.add_argument('--frequency', type=int, default=100, help='frequency of the subscriptions of subscribe-all')
+    parser.add_argument('--words', type=int, default=1023, help='number of words of the transmitex bursts')
+    parser.add_argument('--depth', type=int, default=100, help='number of pipelined requests of flood')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random mix')
+    parser.add_argument('--timeout', type=float, default=10.0, help='maximal time in seconds waiting for a response')
+    args = parser.parse_args()
+
+    names = list(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+    reports = [asyncio.run(run_scenario(name, args)) for name in names]
+    print(json.dumps(reports if args.scenario == 'all' else reports[0], indent=4))
@@ -7,12 +7,29 @@ import json
 import zlib
 import datetime
 import os
+import asyncio
+import heapq
+import itertools
+import math
+import re
+import collections
+import random
+import mmap
+import struct
+import logging
+import logging.handlers
+import queue
+import http.server
+import signal
+import multiprocessing
+import multiprocessing.connection
 
 # todo: hex in form 0xFFFF is accepted, although not specified
 
 GLOBAL_CONFIG = { \
     'host': 'localhost', \
     'port': 50600, \
+    'server_mode': 'threading', \
     'nl_sequence': '\r\n', \
     'error_codes': True, \
     'error_messages': True, \
@@ -21,6 +38,34 @@ GLOBAL_CONFIG = { \
     'max_transmitex_words': 1023, \
     'data_generator_interval': 5.0, \
     'data_generator_word_delay': 0.05, \
+    'data_generator_max_lag': 0.5, \
+    'min_frequency': 5, \
+    'max_frequency': 1000, \
+    'output_flush_size': 65536, \
+    'output_flush_latency': 0.0, \
+    'output_queue_limit': 1048576, \
+    'output_overflow_policy': 'drop-oldest', \
+    'output_disconnect_timeout': 1.0, \
+    'a429_tx_buffer': 4096, \
+    'a429_tx_overflow_policy': 'drop-oldest', \
+    'a429_tx_interval': 0.01, \
+    'a429_loopback': { }, \
+    'replay_file': None, \
+    'replay_speed': 1.0, \
+    'replay_loop': True, \
+    'replay_batch': 10000, \
+    'record_file': None, \
+    'record_flush_interval': 1.0, \
+    'record_queue_limit': 1000000, \
+    'log_level': 'info', \
+    'log_format': 'text', \
+    'metrics_host': 'localhost', \
+    'metrics_port': None, \
+    'workers': 1, \
+    'worker_stats_interval': 1.0, \
+    'worker_shutdown_timeout': 5.0, \
+    'admin_host': 'localhost', \
+    'admin_port': None, \
     
     'equipment': { \
         0: [ 'a429rx', 'high' ], \
@@ -91,6 +136,33 @@ GLOBAL_CONFIG = { \
         0o312: 0x628a00, \
         0o323: 0x6a0500 }, \
     
+    # ARINC 429 labels with changing values, they replace the sample data of the same labels
+    'a429_parameters': { \
+        0o012: { 'encoding': 'bcd', 'digits': 4, 'resolution': 1, 'waveform': [ 'sine', 0, 500, 600.0 ] }, \
+        0o203: { 'encoding': 'bnr', 'range': 131072, 'bits': 17, 'waveform': [ 'sine', 0, 40000, 600.0 ] }, \
+        0o205: { 'encoding': 'bnr', 'range': 4.096, 'bits': 16, 'waveform': [ 'sine', 0.2, 0.82, 600.0 ] }, \
+        0o206: { 'encoding': 'bnr', 'range': 1024, 'bits': 14, 'waveform': [ 'ramp', 120, 350, 300.0 ] }, \
+        0o211: { 'encoding': 'bnr', 'range': 512, 'bits': 11, 'waveform': [ 'step', -40, 15, 120.0 ] }, \
+        0o212: { 'encoding': 'bnr', 'range': 32768, 'bits': 11, 'waveform': [ 'random_walk', -6000, 6000, 500 ] }, \
+        0o270: { 'encoding': 'discrete', 'waveform': [ 'step', 0, 1, 10.0 ] } }, \
+    
+    # sync words of the four ARINC 717 subframes, sent in the first word of each subframe
+    'a717_sync_words': [ 0x247, 0x5b8, 0xa47, 0xdb8 ], \
+    
+    # sources of the ARINC 717 words, all the other words are constant 0x0fff
+    'a717_data': { \
+        1: [ 'counter', 0, 1 ], \
+        2: [ 'ramp', 0, 0xfff, 64.0 ], \
+        3: [ 'recorded', [ 0x001, 0x002, 0x004, 0x008, 0x010, 0x020, 0x040, 0x080 ] ] }, \
+    
+    # state patterns of the discrete inputs, the subscribers are notified at their edges, inputs without a pattern are constantly high
+    'disc_inputs': { \
+        30: [ 'constant', 1 ] }, \
+    
+    # unchanged states of the discrete inputs are sent again after this interval (in seconds), at most at the subscribed frequency,
+    # None sends the changes only
+    'disc_refresh_interval': None, \
+    
 }
 
 GLOBAL_ERRORS = { \
@@ -130,645 +202,2799 @@ GLOBAL_ERRORS = { \
     'INV_CHANNEL_TYPE_DISC': [ 464, 'Channel is not a discrete line' ], \
     'INV_CHANNEL_TYPE_DISC_IN': [ 465, 'Channel is not a discrete input' ], \
     'INV_CHANNEL_TYPE_DISC_OUT': [ 466, 'Channel is not a discrete output' ], \
+    'TX_BUFFER_FULL': [ 467, 'Transmit buffer full' ], \
+    'CHANNEL_LOCKED': [ 468, 'Channel locked by another client' ], \
+    'CHANNEL_NOT_OWNED': [ 469, 'Channel not owned' ], \
 
     'GENERIC_UNSUPPORTED': [ 501, 'Generic parameter not available' ], \
     'UNKNOWN_ERROR': [ 500, 'Some other error' ] \
 }
 
+class LogMessage():
+    # message formatted only when written, by the thread of the log writer
+    def __init__(self, message, args):
+        self.message = message
+        self.args = args
+
+    def __str__(self):
+        return self.message.format(*self.args) if len(self.args) > 0 else self.message
+
+class LogFormatter(logging.Formatter):
+    def __init__(self, json_lines):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        timestamp = datetime.datetime.fromtimestamp(record.created)
+        if self.json_lines:
+            return json.dumps({ 'time': timestamp.isoformat(), 'level': record.levelname.lower(), 'process': record.process, 'thread': record.threadName, 'message': record.getMessage() })
+        return '{} {} {}'.format(timestamp, record.threadName, record.getMessage())
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    # the records are queued as they are, formatting them is left to the writer
+    def prepare(self, record):
+        return record
+
 class Logger():
-    def debug(message: str):
-        print(datetime.datetime.now(), threading.current_thread().name, message)
+    # the records are handed over to a background thread writing them, the messages of disabled levels are not even formatted
+    # (errors are written to the standard error output, everything else to the standard output)
+    logger = logging.getLogger('stap')
+    level = logging.INFO
+    listener = None
 
-    def info(message: str):
-        print(datetime.datetime.now(), threading.current_thread().name, message)
+    levels = { 'debug': logging.DEBUG, 'info': logging.INFO, 'error': logging.ERROR }
+    formats = ['text', 'json']
 
-    def error(message: str):
-        print(datetime.datetime.now(), threading.current_thread().name, message, file=sys.stderr)
+    def configure():
+        Logger.shutdown()
+        # unknown values are reported once the log is running
+        level = Logger.levels.get(str(GLOBAL_CONFIG['log_level']).lower())
+        Logger.level = level if level != None else logging.INFO
+        log_format = GLOBAL_CONFIG['log_format'] if GLOBAL_CONFIG['log_format'] in Logger.formats else 'text'
+        formatter = LogFormatter(log_format == 'json')
+        stdout_handler = logging.StreamHandler(sys.stdout)
+        stdout_handler.addFilter(lambda record: record.levelno < logging.ERROR)
+        stdout_handler.setFormatter(formatter)
+        stderr_handler = logging.StreamHandler(sys.stderr)
+        stderr_handler.setLevel(logging.ERROR)
+        stderr_handler.setFormatter(formatter)
 
-class STAPHandler(socketserver.BaseRequestHandler):
-    def get_ts():
-        return int(time.monotonic() * 1000)
-    
-    def get_err(id: str):
-        if GLOBAL_CONFIG['error_codes'] and id in GLOBAL_ERRORS:
-            if GLOBAL_CONFIG['error_messages']:
-                return 'err,{},{}'.format(GLOBAL_ERRORS[id][0], GLOBAL_ERRORS[id][1]).encode('ascii')
-            else:
-                return 'err,{}'.format(GLOBAL_ERRORS[id][0]).encode('ascii')
+        records = queue.SimpleQueue()
+        Logger.logger.handlers = [LogQueueHandler(records)]
+        Logger.logger.setLevel(Logger.level)
+        Logger.logger.propagate = False
+        Logger.listener = logging.handlers.QueueListener(records, stdout_handler, stderr_handler, respect_handler_level=True)
+        Logger.listener.start()
+        if level == None:
+            Logger.error('Unknown log level {}. Falling back to info.', GLOBAL_CONFIG['log_level'])
+        if log_format != GLOBAL_CONFIG['log_format']:
+            Logger.error('Unknown log format {}. Falling back to text.', GLOBAL_CONFIG['log_format'])
+
+    def shutdown():
+        # the queued records are written before the writer quits
+        if Logger.listener != None:
+            Logger.listener.stop()
+            Logger.listener = None
+
+    def debug(message: str, *args):
+        if Logger.level <= logging.DEBUG:
+            Logger.logger.debug(LogMessage(message, args))
+
+    def info(message: str, *args):
+        if Logger.level <= logging.INFO:
+            Logger.logger.info(LogMessage(message, args))
+
+    def error(message: str, *args):
+        if Logger.level <= logging.ERROR:
+            Logger.logger.error(LogMessage(message, args))
+
+class Histogram():
+    # values in microseconds counted in log-linear buckets (like HDR histograms), 8 buckets per power of two,
+    # so that the quantiles are off by less than 12.5 %
+    size = 8 * 40
+
+    def __init__(self):
+        self.counts = [0] * Histogram.size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0
+
+    def get_upper_bound(index):
+        if index < 16:
+            return index
+        shift = index // 8 - 1
+        return ((index % 8 + 9) << shift) - 1
+
+    def record(self, seconds):
+        # the index of the bucket is the exponent and the 3 bits following the leading one of the value
+        value = int(seconds * 1000000)
+        if value < 16:
+            if value < 0:
+                value = 0
+            index = value
         else:
-            return b'err'
-    
-    def get_crc_bytes(data):
-        return ',{:08x}'.format((zlib.crc32(data + b','))).encode('ascii')
-        
-    def data_generator(self, client):
-        Logger.info('Data generator for the client {}:{} starts.'.format(self.client_address[0], self.client_address[1]))
-        while (self.should_run):
-            # todo: clarify whether locking (for sending data to the socket) is required in the current threading model
-            for ch_id, params in self.session.items():
-                try:
-                    ch_type = GLOBAL_CONFIG['equipment'][ch_id][0]
-                    if ch_type == 'a429rx':
-                        for label in params:
-                            if label in GLOBAL_CONFIG['sample_data']:
-                                time.sleep(GLOBAL_CONFIG['data_generator_word_delay'])
-
-                                data_bytes = '{:x}'.format(GLOBAL_CONFIG['sample_data'][label]).encode('ascii')
-                                message = b'data,' + str(STAPHandler.get_ts()).encode('ascii') + b',' + \
-                                    str(ch_id).encode('ascii') + b',' + \
-                                    '{:o}'.format(label).encode('ascii') + b',' + \
-                                    (b'0' if len(data_bytes) % 2 == 1 else b'') + data_bytes
-                                client.sendall(message)
-                                if self.crc32:
-                                    client.sendall(STAPHandler.get_crc_bytes(message))
-                                client.sendall(b'\r\n')
-
-                    elif ch_type == 'a717rx':
-                        for subframe in range(len(params)):
-                            for word in params[subframe]:
-                                time.sleep(GLOBAL_CONFIG['data_generator_word_delay'])
-                                message = b'data,' + str(STAPHandler.get_ts()).encode('ascii') + b',' + \
-                                    str(ch_id).encode('ascii') + b',' + \
-                                    str(subframe).encode('ascii') + b',' + \
-                                    str(word).encode('ascii') + b',' + \
-                                    b'0fff'
-                                client.sendall(message)
-                                if self.crc32:
-                                    client.sendall(STAPHandler.get_crc_bytes(message))
-                                client.sendall(b'\r\n')
-
-                    elif ch_type == 'disc':
-                        time.sleep(GLOBAL_CONFIG['data_generator_word_delay'])
-                        message = b'data,' + str(STAPHandler.get_ts()).encode('ascii') + b',' + \
-                            b'disc,' + \
-                            str(ch_id).encode('ascii') + b',' + \
-                            b'1'
-                        client.sendall(message)
-                        if self.crc32:
-                            client.sendall(STAPHandler.get_crc_bytes(message))
-                        client.sendall(b'\r\n')
-                except:
-                    Logger.info('Error sending data to the client {}:{}. Interrupting the data delivery thread.'.format(self.client_address[0], self.client_address[1]))
-                    return
-            time.sleep(GLOBAL_CONFIG['data_generator_interval'])
-        Logger.info('Data generator for the client {}:{} quits.'.format(self.client_address[0], self.client_address[1]))
+            shift = value.bit_length() - 4
+            index = shift * 8 + (value >> shift)
+            if index >= Histogram.size:
+                index = Histogram.size - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if value > self.max:
+            self.max = value
 
-    def handle_request(self, request):
-        args = request.split(b',')
-        if args[0] == b'status':
-            if len(args) != 1:
-                return STAPHandler.get_err('INV_ARG_NO')
-                
-            equipment = b''
-            for ch_id, channel in GLOBAL_CONFIG['equipment'].items():
-                if len(equipment) > 0:
-                    equipment += b','
-                equipment += channel[0].encode('ascii') + b'{' + str(ch_id).encode('ascii')
-                for prop in channel[1:]:
-                    equipment += b',' + str(prop).encode('ascii')
-                equipment += b'}'
-            equipment = b'equipment{' + equipment + b'}'
-            
-            session = b''
-            for ch_id, params in self.session.items():
-                ch_type = GLOBAL_CONFIG['equipment'][ch_id][0]
-                if ch_type == 'a429rx':
-                    for label in params:
-                        if len(session) > 0:
-                            session += b','
-                        session += b'a429{' + str(ch_id).encode('ascii') + b',' + '{:o}'.format(label).encode('ascii') + b'}'
-                elif ch_type == 'a717rx':
-                    for subframe in range(len(params)):
-                        for word in params[subframe]:
-                            if len(session) > 0:
-                                session += b','
-                            session += b'a717{' + str(ch_id).encode('ascii') + b',' + str(subframe).encode('ascii') + b',' + str(word).encode('ascii') + b'}'
-                elif ch_type == 'disc':
-                    if len(session) > 0:
-                            session += b','
-                    session += b'disc{' + str(ch_id).encode('ascii') + b',' + str(params).encode('ascii') + b'}'
-            session = b'session{' + session + b'}'
-            
-            return b'status,' + \
-                GLOBAL_CONFIG['stap_version'].encode('ascii') + b',' + \
-                equipment + b',' + \
-                session
-                
-        elif args[0] == b'add':
-            if len(args) != 3 and len(args) != 4:
-                return STAPHandler.get_err('INV_ARG_NO')
-            
-            if args[1] == b'disc':
-                try:
-                    ch_id = int(args[2])
-                except:
-                    return STAPHandler.get_err('INV_CHANNEL_FORMAT')
-                
-                if ch_id in GLOBAL_CONFIG['equipment']:
-                    channel = GLOBAL_CONFIG['equipment'][ch_id]
-                    if channel[0] == 'disc':
-                        if channel[1] == 'in':
-                            try:
-                                frequency = int(args[3])
-                            except:
-                                return STAPHandler.get_err('INV_FREQ_FORMAT')
-                            
-                            if frequency >= 5:
-                                if ch_id in self.session:
-                                    return STAPHandler.get_err('DISC_ALREADY_SUBS')
-                                else:
-                                    self.session[ch_id] = frequency
-                                    return b'ok'
-                            else:
-                                return STAPHandler.get_err('INV_FREQUENCY_RANGE')
-                        else:
-                            return STAPHandler.get_err('INV_CHANNEL_TYPE_DISC_IN')
-                    else:
-                        return STAPHandler.get_err('INV_CHANNEL_TYPE_DISC')
-                return STAPHandler.get_err('CHANNEL_NOT_FOUND')
-            
-            elif args[1] == b'generic':
-                return STAPHandler.get_err('GENERIC_UNSUPPORTED')
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count > 0:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def get_quantile(self, quantile):
+        # upper bound of the bucket holding the quantile (in microseconds), never more than the maximum
+        rank = quantile * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if count > 0 and cumulative >= rank:
+                return min(Histogram.get_upper_bound(index), self.max)
+        return 0
+
+class Metrics():
+    # counters and latency histograms of a single thread, updated without any locking,
+    # the metrics of all the threads are merged when collected
+    local = threading.local()
+    shards = []
+    retired = None
+    lock = threading.Lock()
 
+    quantiles = [0.5, 0.9, 0.99, 0.999]
+
+    # the names, types and descriptions of the metrics in the Prometheus format, with the name of their label
+    descriptions = { \
+        'connections': [ 'stap_connections_total', 'counter', 'Connections accepted.', None ], \
+        'requests': [ 'stap_request_latency_seconds', 'summary', 'Processing time of the requests per command.', 'command' ], \
+        'errors': [ 'stap_errors_total', 'counter', 'Error responses per error code.', 'code' ], \
+        'received': [ 'stap_received_bytes_total', 'counter', 'Bytes received from the clients.', None ], \
+        'sent': [ 'stap_sent_bytes_total', 'counter', 'Bytes handed over to the writers of the clients.', None ], \
+        'dropped': [ 'stap_dropped_lines_total', 'counter', 'Data lines and transmitted words dropped due to the overflow policies.', None ], \
+        'emission': [ 'stap_data_emission_seconds', 'summary', 'Processing time of the scheduler batches generating the data.', None ], \
+        'lag': [ 'stap_generator_lag_seconds', 'summary', 'Delay of the data generation behind its deadlines.', None ] }
+
+    def __init__(self):
+        self.counters = collections.defaultdict(int)
+        self.histograms = dict()
+
+    def get():
+        # the metrics of the current thread
+        try:
+            return Metrics.local.shard
+        except AttributeError:
+            shard = Metrics()
+            Metrics.local.shard = shard
+            with Metrics.lock:
+                Metrics.shards.append(shard)
+            return shard
+
+    def retire():
+        # the metrics of a finishing thread are kept in the totals only
+        shard = getattr(Metrics.local, 'shard', None)
+        if shard != None:
+            del Metrics.local.shard
+            with Metrics.lock:
+                Metrics.shards.remove(shard)
+                if Metrics.retired == None:
+                    Metrics.retired = Metrics()
+                Metrics.retired.merge(shard)
+
+    def count(self, key, value = 1):
+        self.counters[key] += value
+
+    def observe(self, key, seconds):
+        histogram = self.histograms.get(key)
+        if histogram == None:
+            histogram = Histogram()
+            self.histograms[key] = histogram
+        histogram.record(seconds)
+
+    def merge(self, other):
+        # the metrics of another thread may be updated meanwhile, the items are copied at once
+        for key, value in list(other.counters.items()):
+            self.counters[key] += value
+        for key, other_histogram in list(other.histograms.items()):
+            histogram = self.histograms.get(key)
+            if histogram == None:
+                histogram = Histogram()
+                self.histograms[key] = histogram
+            histogram.merge(other_histogram)
+
+    def collect():
+        result = Metrics()
+        with Metrics.lock:
+            for shard in Metrics.shards + ([Metrics.retired] if Metrics.retired != None else []):
+                result.merge(shard)
+        return result
+
+    def get_entries(self):
+        # the counters and histograms ordered by their names and labels
+        # (the keys are tuples of the name and the label, or the name only)
+        entries = [(key, value) for key, value in self.counters.items()] + [(key, value) for key, value in self.histograms.items()]
+        return sorted(entries, key=lambda entry: (entry[0], '') if isinstance(entry[0], str) else (entry[0][0], Metrics.get_label(entry[0][0], entry[0][1])))
+
+    def get_label(name, label):
+        # error IDs are reported by their codes
+        if name == 'errors':
+            return str(GLOBAL_ERRORS[label][0]) if label in GLOBAL_ERRORS else label
+        return label.decode('ascii', 'replace')
+
+    def format_prometheus(source):
+        # the source is a server or the supervisor of the workers
+        metrics, clients = source.get_metrics()
+        lines = ['# HELP stap_connections_open Connections currently open.', '# TYPE stap_connections_open gauge', 'stap_connections_open {}'.format(clients)]
+        described = set()
+        for key, value in metrics.get_entries():
+            name, label = key if isinstance(key, tuple) else (key, None)
+            metric, metric_type, description, label_name = Metrics.descriptions[name]
+            if name not in described:
+                lines.append('# HELP {} {}'.format(metric, description))
+                lines.append('# TYPE {} {}'.format(metric, metric_type))
+                described.add(name)
+            labels = '{}="{}"'.format(label_name, Metrics.get_label(name, label)) if label != None else ''
+            if metric_type == 'summary':
+                for quantile in Metrics.quantiles:
+                    lines.append('{}{{{}}} {}'.format(metric, (labels + ',' if len(labels) > 0 else '') + 'quantile="{}"'.format(quantile), value.get_quantile(quantile) / 1e6))
+                lines.append('{}_sum{} {}'.format(metric, '{' + labels + '}' if len(labels) > 0 else '', value.total))
+                lines.append('{}_count{} {}'.format(metric, '{' + labels + '}' if len(labels) > 0 else '', value.count))
             else:
-                try:
-                    ch_id = int(args[1])
-                except:
-                    return STAPHandler.get_err('INV_CHANNEL_FORMAT')
-                        
-                if ch_id in GLOBAL_CONFIG['equipment']:
-                    channel = GLOBAL_CONFIG['equipment'][ch_id]
+                lines.append('{}{} {}'.format(metric, '{' + labels + '}' if len(labels) > 0 else '', value))
+        return ('\n'.join(lines) + '\n').encode('utf-8')
 
-                    if channel[0] == 'a429rx':
-                        try:
-                            label = args[2] if args[2] == b'all' else int(args[2], 8)
-                        except:
-                            return STAPHandler.get_err('INV_LABEL_FORMAT')
-                        
-                        if label != b'all' and (label < 0 or label > 255):
-                            return STAPHandler.get_err('INV_LABEL_RANGE')
-                        
-                        if label == b'all':
-                            self.session[ch_id] = set(range(256))
-                        else:
-                            if ch_id in self.session:
-                                if label in self.session[ch_id]:
-                                    return STAPHandler.get_err('LABEL_ALREADY_SUBS')
-                                else:
-                                    self.session[ch_id].add(label)
-                            else:
-                                self.session[ch_id] = { label }
-                        
-                        return b'ok'
-                        
-                    elif channel[0] == 'a717rx':
-                        try:
-                            subframe = args[2] if args[2] == b'all' else int(args[2])
-                        except:
-                            return STAPHandler.get_err('INV_SUBFRAME_FORMAT')
-                        
-                        try:
-                            word = args[3] if args[3] == b'all' else int(args[3])
-                        except:
-                            return STAPHandler.get_err('INV_WORD_FORMAT')
-                        
-                        if subframe != b'all' and (subframe < 0 or subframe >= 4):
-                            return STAPHandler.get_err('INV_SUFRAME_RANGE')
-                            
-                        if word != b'all' and (word < 0 or word >= channel[1]):
-                            return STAPHandler.get_err('INV_WORD_RANGE')
-                            
-                        if ch_id not in self.session:
-                            self.session[ch_id] = [set() for x in range(4)]
-                        
-                        if subframe == b'all':
-                            # in case of 'all' approach, no existing subscription will be checked
-                            if word == b'all':
-                                for subframe in range(4):
-                                    self.session[ch_id][subframe].update(set(range(channel[1])))
-                            else:
-                                for subframe in range(4):
-                                    self.session[ch_id][subframe].add(word)
-                        else:
-                            if word == b'all':
-                                # in case of 'all' approach, no existing subscription will be checked
-                                self.session[ch_id][subframe].update(set(range(channel[1])))
-                            else:
-                                if word in self.session[ch_id][subframe]:
-                                    return STAPHandler.get_err('WORD_ALREADY_SUBS')
-                                else:
-                                    self.session[ch_id][subframe].add(word)
-                        return b'ok'
-            
-                return STAPHandler.get_err('CHANNEL_NOT_FOUND')
+    def format_diag(server):
+        # the latencies as the number of values, the median, the 99th percentile and the maximum (in microseconds)
+        metrics, clients = server.get_metrics()
+        def latency(histogram):
+            return b'%d,%d,%d,%d' % (histogram.count, histogram.get_quantile(0.5), histogram.get_quantile(0.99), histogram.max)
 
-        elif args[0] == b'remove':
-            if len(args) != 3 and len(args) != 4:
-                return STAPHandler.get_err('INV_ARG_NO')
-                
-            if args[1] == b'disc':
+        groups = { 'requests': [], 'errors': [] }
+        for key, value in metrics.get_entries():
+            if isinstance(key, tuple):
+                label = Metrics.get_label(key[0], key[1]).encode('ascii', 'replace')
+                groups[key[0]].append(label + b'{' + (latency(value) if isinstance(value, Histogram) else b'%d' % value) + b'}')
+
+        empty = Histogram()
+        return b'diag,' + \
+            b'connections{%d,%d},' % (clients, metrics.counters['connections']) + \
+            b'bytes{%d,%d},' % (metrics.counters['received'], metrics.counters['sent']) + \
+            b'dropped{%d},' % metrics.counters['dropped'] + \
+            b'lag{' + latency(metrics.histograms.get('lag', empty)) + b'},' + \
+            b'emission{' + latency(metrics.histograms.get('emission', empty)) + b'},' + \
+            b'requests{' + b','.join(groups['requests']) + b'},' + \
+            b'errors{' + b','.join(groups['errors']) + b'}'
+
+class DataScheduler():
+    # server-wide scheduler owning the data generation of all sessions, ordered by deadlines in a heap
+    def __init__(self):
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.should_run = True
+        self.running = False
+        self.wakeup = None
+
+    def schedule(self, entry, deadline):
+        with self.condition:
+            heapq.heappush(self.queue, (deadline, next(self.sequence), entry))
+            if self.queue[0][2] is entry and not self.running:
+                # the new entry is the earliest one, the driver needs to adapt its sleeping time
+                # (unless it is firing a batch right now, it will check the queue afterwards anyway)
+                self.condition.notify()
+                if self.wakeup != None:
+                    self.wakeup()
+
+    def get_timeout(self):
+        with self.condition:
+            return max(0.0, self.queue[0][0] - time.monotonic()) if len(self.queue) > 0 else None
+
+    def run_due(self, tolerance = 0.0):
+        # fires all the due entries in one batch, cancelled entries are just dropped
+        now = time.monotonic()
+        due = []
+        with self.condition:
+            while len(self.queue) > 0 and self.queue[0][0] <= now + tolerance:
+                due.append(heapq.heappop(self.queue))
+            self.running = True
+
+        metrics = Metrics.get()
+        try:
+            for deadline, sequence, entry in due:
+                metrics.observe('lag', now - deadline)
+                # a failing entry decides on its own how to carry on, the other ones keep running
                 try:
-                    ch_id = int(args[2])
-                except:
-                    return STAPHandler.get_err('INV_CHANNEL_FORMAT')
-                    
-                if ch_id in GLOBAL_CONFIG['equipment']:
-                    channel = GLOBAL_CONFIG['equipment'][ch_id]
-                    
-                    if channel[0] == 'disc':
-                        if channel[1] == 'in':
-                            if ch_id in self.session:
-                                del self.session[ch_id]
-                                return b'ok'
-                            else:
-                                return STAPHandler.get_err('DISC_NOT_SUBS')
-                        else:
-                            return STAPHandler.get_err('INV_CHANNEL_TYPE_DISC_IN')
-                    else:
-                        return STAPHandler.get_err('INV_CHANNEL_TYPE_DISC')
-                        
-                return STAPHandler.get_err('CHANNEL_NOT_FOUND')
-            
-            elif args[1] == b'generic':
-                return STAPHandler.get_err('GENERIC_UNSUPPORTED')
+                    deadline = entry.fire(deadline, now)
+                except Exception as ex:
+                    Logger.error('Failed to run the scheduler entry {} due to {}.', type(entry).__name__, str(ex))
+                    deadline = entry.recover(deadline, now)
+                if deadline != None:
+                    self.schedule(entry, deadline)
 
-            else:
+            # the output produced by the whole batch is written at once
+            for deadline, sequence, entry in due:
                 try:
-                    ch_id = int(args[1])
-                except:
-                    return STAPHandler.get_err('INV_CHANNEL_FORMAT')
+                    entry.flush()
+                except Exception as ex:
+                    Logger.error('Failed to flush the scheduler entry {} due to {}.', type(entry).__name__, str(ex))
+            if len(due) > 0:
+                metrics.observe('emission', time.monotonic() - now)
+        finally:
+            with self.condition:
+                self.running = False
 
-                if ch_id in GLOBAL_CONFIG['equipment']:
-                    channel = GLOBAL_CONFIG['equipment'][ch_id]
-                    
-                    if channel[0] == 'a429rx':
-                        try:
-                            label = args[2] if args[2] == b'all' else int(args[2], 8)
-                        except:
-                            return STAPHandler.get_err('INV_LABEL_FORMAT')
-                        
-                        if label != b'all' and (label < 0 or label > 255):
-                            return STAPHandler.get_err('INV_LABEL_RANGE')
-                        
-                        if label == b'all':
-                            self.session[ch_id] = set()
-                        else:
-                            if ch_id in self.session:
-                                try:
-                                    self.session[ch_id].remove(label)
-                                except:
-                                    return STAPHandler.get_err('LABEL_NOT_SUBS')
-                            else:
-                                return STAPHandler.get_err('LABEL_NOT_SUBS')
-                        
-                        return b'ok'
-                        
-                    elif channel[0] == 'a717rx':
-                        try:
-                            subframe = args[2] if args[2] == b'all' else int(args[2])
-                        except:
-                            return STAPHandler.get_err('INV_SUBFRAME_FORMAT')
-                        
-                        try:
-                            word = args[3] if args[3] == b'all' else int(args[3])
-                        except:
-                            return STAPHandler.get_err('INV_WORD_FORMAT')
-                        
-                        if subframe != b'all' and (subframe < 0 or subframe >= 4):
-                            return STAPHandler.get_err('INV_SUFRAME_RANGE')
-                            
-                        if word != b'all' and (word < 0 or word >= channel[1]):
-                            return STAPHandler.get_err('INV_WORD_RANGE')
-
-                        if subframe == b'all':
-                            # in case of 'all' approach, no existing subscription will be checked
-                            if ch_id in self.session:
-                                if word == b'all':
-                                    del self.session[ch_id]
-                                else:
-                                    for subframe in range(4):
-                                        self.session[ch_id][subframe].discard(word)
-                        else:
-                            if word == b'all':
-                                # in case of 'all' approach, no existing subscription will be checked
-                                if ch_id in self.session:
-                                    self.session[ch_id][subframe] = set()
-                            else:
-                                try:
-                                    self.session[ch_id][subframe].remove(word)
-                                except:
-                                    return STAPHandler.get_err('WORD_NOT_SUBS')
+    def run(self):
+        # driver of the threading mode
+        while self.should_run:
+            self.run_due()
+            with self.condition:
+                if self.should_run:
+                    timeout = max(0.0, self.queue[0][0] - time.monotonic()) if len(self.queue) > 0 else None
+                    if timeout == None or timeout > 0:
+                        self.condition.wait(timeout)
 
-                        return b'ok'
-            
-                return STAPHandler.get_err('CHANNEL_NOT_FOUND')
-            
-        elif args[0] == b'lock' or args[0] == b'release':
-            
-            if len(args) == 2:
-                try:
-                    ch_id = int(args[1])
-                except:
-                    return STAPHandler.get_err('INV_CHANNEL_FORMAT')
-                    
-                if ch_id in GLOBAL_CONFIG['equipment']:
-                    channel = GLOBAL_CONFIG['equipment'][ch_id]
+    async def run_async(self):
+        # driver of the asyncio mode
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        # entries are scheduled from other threads as well (changes of the configuration)
+        self.wakeup = lambda: loop.call_soon_threadsafe(event.set)
+        while self.should_run:
+            event.clear()
+            # the event loop sleeps with a millisecond resolution, so entries due within it are fired already
+            self.run_due(0.001)
+            timeout = self.get_timeout()
+            timer = loop.call_later(timeout, event.set) if timeout != None else None
+            await event.wait()
+            if timer != None:
+                timer.cancel()
 
-                    if channel[0] == 'a429tx' or channel[0] == 'disc' and channel[1] == 'out':
-                        return b'ok'
-                    else:
-                        return STAPHandler.get_err('INV_CHANNEL_TYPE_OUTPUT')
-                
-                return STAPHandler.get_err('CHANNEL_NOT_FOUND')
+    def shutdown(self):
+        with self.condition:
+            self.should_run = False
+            self.condition.notify()
+
+class MessageTemplates():
+    # preformatted parts of the generated data lines following the timestamp,
+    # they have to be rebuilt whenever the sample data change (the caches are keyed by the identity of the sample data)
+
+    # running CRC32 state of the constant beginning of all data lines
+    data_crc = zlib.crc32(b'data,')
+
+    def build(suffix):
+        # the suffix followed by the separator of the checksum is used in the CRC32 mode,
+        # the one followed by the new-line sequence for plain lines
+        return (suffix + b',', suffix + b'\r\n')
+
+    def a429(ch_id, label, sample_data):
+        if label not in sample_data:
+            return None
+        return MessageTemplates.a429_word(ch_id, label, sample_data[label])
+
+    def a429_word(ch_id, label, data):
+        data_bytes = '{:x}'.format(data).encode('ascii')
+        return MessageTemplates.build(b',' + str(ch_id).encode('ascii') + b',' + \
+            '{:o}'.format(label).encode('ascii') + b',' + \
+            (b'0' if len(data_bytes) % 2 == 1 else b'') + data_bytes)
+
+    def disc(ch_id, state = 1):
+        return MessageTemplates.build(b',disc,' + str(ch_id).encode('ascii') + b',' + str(state).encode('ascii'))
+
+class A429Parameters():
+    # synthesis of the data of the labels configured in a429_parameters (23 bits: SDI in bits 0-1, data in bits 2-20,
+    # SSM in bits 21-22), all the parameters are evaluated at once per point in time, waveform by waveform,
+    # and the result is shared by all the channels and clients generating data at that time
+    cached = (None, None, dict())
+    walks = dict()
+
+    # positions of the BCD digits, the most significant one has 3 bits only
+    bcd_shifts = [ 18, 14, 10, 6, 2 ]
+
+    def sine(waveform, t):
+        return waveform[1] + (waveform[2] - waveform[1]) * (1 + math.sin(2 * math.pi * t / waveform[3])) / 2
+
+    def ramp(waveform, t):
+        return waveform[1] + (waveform[2] - waveform[1]) * (t % waveform[3]) / waveform[3]
+
+    def step(waveform, t):
+        # the low value in the first half of the period, the high one in the second
+        return waveform[1] if t % waveform[3] < waveform[3] / 2 else waveform[2]
+
+    def constant(waveform, t):
+        return waveform[1]
+
+    def random_walk(label, waveform, t):
+        # the deviation grows with the square root of the elapsed time (the step being the deviation per second),
+        # the walk is reflected at the limits
+        last_t, value = A429Parameters.walks.get(label, (t, (waveform[1] + waveform[2]) / 2))
+        if t > last_t:
+            value += random.gauss(0, waveform[3] * math.sqrt(t - last_t))
+            if value > waveform[2]:
+                value = max(waveform[1], 2 * waveform[2] - value)
+            elif value < waveform[1]:
+                value = min(waveform[2], 2 * waveform[1] - value)
+            A429Parameters.walks[label] = (t, value)
+        return value
+
+    def encode(parameter, value):
+        encoding = parameter.get('encoding', 'bnr')
+        if encoding == 'bnr':
+            # two's complement of the given number of significant bits below the sign bit
+            bits = parameter['bits']
+            raw = int(round(value * (1 << bits) / parameter['range']))
+            raw = max(-(1 << bits), min((1 << bits) - 1, raw))
+            data = (raw & ((1 << (bits + 1)) - 1)) << (20 - bits)
+            ssm = parameter.get('ssm', 3)
+        elif encoding == 'bcd':
+            digits = parameter.get('digits', 5)
+            number = min(int(round(abs(value) / parameter.get('resolution', 1))), int('7' + '9' * (digits - 1)))
+            data = 0
+            for shift, digit in zip(A429Parameters.bcd_shifts, '%0*d' % (digits, number)):
+                data |= int(digit) << shift
+            # plus or minus
+            ssm = parameter.get('ssm', 3 if value < 0 else 0)
+        else:
+            # discrete bits of the data field
+            data = (int(value) & 0x7ffff) << 2
+            ssm = parameter.get('ssm', 0)
+        return (ssm & 3) << 21 | data | (parameter.get('sdi', 0) & 3)
+
+    def get_data(t, parameters):
+        # the points in time of the different channels and frequencies are compared in microseconds
+        key = round(t, 6)
+        if A429Parameters.cached[0] == key and A429Parameters.cached[1] is parameters:
+            return A429Parameters.cached[2]
+
+        groups = dict()
+        for label, parameter in parameters.items():
+            groups.setdefault(parameter['waveform'][0], []).append(label)
+
+        values = dict()
+        for kind, labels in groups.items():
+            if kind == 'random_walk':
+                values.update(zip(labels, [A429Parameters.random_walk(label, parameters[label]['waveform'], t) for label in labels]))
             else:
-                return STAPHandler.get_err('INV_ARG_NO')
-                    
-        elif args[0] == b'transmit':
-            if len(args) != 4:
-                return STAPHandler.get_err('INV_ARG_NO')
-            
-            try:
-                ch_id = int(args[1])
-            except:
-                return STAPHandler.get_err('INV_CHANNEL_FORMAT')
-                
-            if ch_id in GLOBAL_CONFIG['equipment']:
-                if GLOBAL_CONFIG['equipment'][ch_id][0] != 'a429tx':
-                    return STAPHandler.get_err('INV_CHANNEL_TYPE_A429TX')
+                function = getattr(A429Parameters, kind, A429Parameters.constant)
+                values.update(zip(labels, [function(parameters[label]['waveform'], t) for label in labels]))
+
+        data = { label: A429Parameters.encode(parameters[label], value) for label, value in values.items() }
+        A429Parameters.cached = (key, parameters, data)
+        return data
+
+class A717Frames():
+    # contents of the ARINC 717 subframes, the values are functions of the time of the subframe (in full seconds),
+    # so all the clients see the same frames
+    default = [ 'constant', 0x0fff ]
+
+    # suffixes of the lines of the constant words per channel and subframe, valid for the sources and sync words
+    # they were built of (held together, so that they are replaced by a single assignment)
+    cache = (None, None, dict())
+
+    def get_word(subframe, word, t, config):
+        if word == 0:
+            return config['a717_sync_words'][subframe]
+
+        source = config['a717_data'].get(word, A717Frames.default)
+        if source[0] == 'counter':
+            # incremented with each subframe
+            value = source[1] + source[2] * t
+        elif source[0] == 'ramp':
+            # from the minimum to the maximum within the period (in seconds)
+            value = source[1] + (source[2] - source[1]) * (t % source[3]) / source[3]
+        elif source[0] == 'recorded':
+            # the recorded values are repeated, one per subframe
+            value = source[1][t % len(source[1])]
+        else:
+            value = source[1]
+        return int(value) & 0xfff
+
+    def get_templates(ch_id, subframe, config):
+        cache = A717Frames.cache
+        if cache[0] is not config['a717_data'] or cache[1] is not config['a717_sync_words']:
+            cache = (config['a717_data'], config['a717_sync_words'], dict())
+            A717Frames.cache = cache
+        templates = cache[2].get((ch_id, subframe))
+        if templates == None:
+            templates = dict()
+            cache[2][(ch_id, subframe)] = templates
+        return templates
+
+    def format(ch_id, subframe, t, words, crc32, config):
+        # a whole subframe is generated at once, each word carries the time it takes its place on the bus
+        wps = config['equipment'][ch_id][1]
+        start = t * 1000
+        prefix = b',%d,%d,' % (ch_id, subframe)
+        sources = config['a717_data']
+        templates = A717Frames.get_templates(ch_id, subframe, config)
+        stamps = dict()
+        lines = []
+        for word in words:
+            suffix = templates.get(word)
+            if suffix == None:
+                suffix = prefix + b'%d,%04x' % (word, A717Frames.get_word(subframe, word, t, config))
+                if word == 0 or sources.get(word, A717Frames.default)[0] == 'constant':
+                    templates[word] = suffix
+            # the words sharing a millisecond share the beginning of their lines
+            offset = word * 1000 // wps
+            stamp = stamps.get(offset)
+            if stamp == None:
+                ts = b'%d' % (start + offset)
+                stamp = (b'data,' + ts, zlib.crc32(ts, MessageTemplates.data_crc))
+                stamps[offset] = stamp
+            if crc32:
+                lines.append(stamp[0] + suffix + b',%08x\r\n' % zlib.crc32(suffix + b',', stamp[1]))
             else:
-                return STAPHandler.get_err('CHANNEL_NOT_FOUND')
-                
-            try:
-                label = int(args[2], 8)
-            except:
-                return STAPHandler.get_err('INV_LABEL_FORMAT')
-                
-            if label < 0 or label > 255:
-                return STAPHandler.get_err('INV_LABEL_RANGE')
-                
-            try:
-                data = int(args[3], 16)
-            except:
-                return STAPHandler.get_err('INV_DATA_FORMAT')
-            
-            if data < 0 or data > 0x7fffff:
-                return STAPHandler.get_err('INV_DATA_RANGE')
-                
-            return b'ok'            
+                lines.append(stamp[0] + suffix + b'\r\n')
+        return lines
 
-        elif args[0] == b'put':
-            if len(args) != 3:
-                return STAPHandler.get_err('INV_ARG_NO')
-            try:
-                ch_id = int(args[1])
-            except:
-                return STAPHandler.get_err('INV_CHANNEL_FORMAT')
-                    
-            if ch_id in GLOBAL_CONFIG['equipment']:
-                channel = GLOBAL_CONFIG['equipment'][ch_id]
-                
-                if channel[0] == 'disc':
-                    if channel[1] == 'out':
-                        if args[2] == b'0' or args[2] == b'1':
-                            return b'ok'
-                        else:
-                            return STAPHandler.get_err('INV_STATE_VALUE')
-                    else:
-                        return STAPHandler.get_err('INV_CHANNEL_TYPE_DISC_OUT')
-                else:
-                    return STAPHandler.get_err('INV_CHANNEL_TYPE_DISC')
-            
-            return STAPHandler.get_err('CHANNEL_NOT_FOUND')
+class DiscreteInputs():
+    # states of the discrete inputs as functions of the time, with the points in time they change next,
+    # so the notifications carry the exact time of the edges
+    default = [ 'constant', 1 ]
 
-        elif args[0] == b'get':
-            if len(args) != 2:
-                return STAPHandler.get_err('INV_ARG_NO')
-                
-            try:
-                ch_id = int(args[1])
-            except:
-                return STAPHandler.get_err('INV_CHANNEL_FORMAT')
-                    
-            if ch_id in GLOBAL_CONFIG['equipment']:
-                channel = GLOBAL_CONFIG['equipment'][ch_id]
-                if channel[0] == 'disc':
-                    if channel[1] == 'in':
-                        return b'data,' + str(STAPHandler.get_ts()).encode('ascii') + b',' + args[1] + b',1'
-                    else:
-                        return STAPHandler.get_err('INV_CHANNEL_TYPE_DISC_IN')
-                else:
-                    return STAPHandler.get_err('INV_CHANNEL_TYPE_DISC')
-            
-            return STAPHandler.get_err('CHANNEL_NOT_FOUND')
+    def get_state(ch_id, t, config):
+        pattern = config['disc_inputs'].get(ch_id, DiscreteInputs.default)
+        if pattern[0] == 'square':
+            # high for the duty cycle at the beginning of each period (in seconds)
+            duty = pattern[2] if len(pattern) > 2 else 0.5
+            return 1 if t % pattern[1] < duty * pattern[1] else 0
+        elif pattern[0] == 'script':
+            # the steps of states and durations (in seconds) are repeated
+            steps = pattern[1]
+            length = sum([duration for state, duration in steps])
+            offset = t % length if length > 0 else 0
+            for state, duration in steps:
+                if offset < duration:
+                    return state
+                offset -= duration
+            return steps[-1][0]
+        else:
+            return pattern[1]
 
-        elif args[0] == b'transmitex':
-            if len(args) < 3:
-                return STAPHandler.get_err('INV_ARG_NO')
-                
+    def get_next_edge(ch_id, t, config):
+        # the next point in time the state may change, None if it stays
+        pattern = config['disc_inputs'].get(ch_id, DiscreteInputs.default)
+        if pattern[0] == 'square':
+            duty = pattern[2] if len(pattern) > 2 else 0.5
+            start = t - t % pattern[1]
+            return start + duty * pattern[1] if t < start + duty * pattern[1] else start + pattern[1]
+        elif pattern[0] == 'script':
+            length = sum([duration for state, duration in pattern[1]])
+            if length <= 0:
+                return None
+            end = t - t % length
+            for state, duration in pattern[1]:
+                end += duration
+                if t < end:
+                    return end
+            return end
+        else:
+            return None
+
+class Bitmap():
+    # subscribed labels and words are stored as bits of plain integers, bit n set meaning item n is subscribed
+    # positions of the set bits of all byte values
+    positions = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+    def full(size):
+        return (1 << size) - 1
+
+    def contains(mask, item):
+        return mask >> item & 1 == 1
+
+    def items(mask):
+        # the bitmap is scanned byte by byte, empty bytes are skipped by a single check
+        result = []
+        positions = Bitmap.positions
+        for index, value in enumerate(mask.to_bytes((mask.bit_length() + 7) // 8, 'little')):
+            if value != 0:
+                base = index * 8
+                result.extend([base + bit for bit in positions[value]])
+        return result
+
+class DataPublisher():
+    # base of the scheduler entries delivering data to the clients, the output of a batch is flushed at its end
+    def __init__(self):
+        self.delivered = []
+
+    def publish(self, handler, chunks):
+        try:
+            handler.output.append(chunks)
+            self.delivered.append(handler)
+        except:
+            Logger.info('Error sending data to the client {}:{}. Interrupting the data delivery.', handler.client_address[0], handler.client_address[1])
+            handler.should_run = False
+
+    def flush(self):
+        for handler in self.delivered:
             try:
-                ch_id = int(args[1])
+                handler.output.flush_later()
             except:
-                return STAPHandler.get_err('INV_CHANNEL_FORMAT')
-                
-            if ch_id in GLOBAL_CONFIG['equipment']:
-                if GLOBAL_CONFIG['equipment'][ch_id][0] != 'a429tx':
-                    return STAPHandler.get_err('INV_CHANNEL_TYPE_A429TX')
+                Logger.info('Error sending data to the client {}:{}. Interrupting the data delivery.', handler.client_address[0], handler.client_address[1])
+                handler.should_run = False
+        self.delivered = []
+
+    def recover(self, deadline, now):
+        # called by the scheduler after a failure of fire, returns the next deadline as fire does
+        return None
+
+class DataSubscription():
+    # channel subscribed by a client at a specific frequency, its data are generated by the topic shared with other clients
+    def __init__(self, handler, ch_id, frequency):
+        self.handler = handler
+        self.ch_id = ch_id
+        self.frequency = frequency
+        self.labels = 0
+        self.active = True
+
+    def cancel(self):
+        self.active = False
+
+class DataTopic(DataPublisher):
+    # scheduler entry generating the data of a channel at a specific frequency for all the subscribed clients at once,
+    # the lines of equal subscriptions are formatted once per cycle and the same bytes are delivered to all of them
+    def __init__(self, server, ch_id, frequency):
+        super().__init__()
+        self.server = server
+        self.ch_id = ch_id
+        self.frequency = frequency
+        self.members = set()
+        self.templates = (None, dict())
+        self.cached = dict()
+
+    def get_period(self, config):
+        if config['equipment'][self.ch_id][0] == 'a717rx':
+            # one subframe per second
+            return 1.0
+        elif self.frequency != None:
+            return 1.0 / self.frequency
+        else:
+            return config['data_generator_interval']
+
+    def get_first_deadline(self, now):
+        if GLOBAL_CONFIG['equipment'][self.ch_id][0] == 'a717rx':
+            # subframes start at full seconds
+            return math.floor(now) + 1.0
+        elif self.frequency != None:
+            # the topics of the same frequency share the points in time, so that they share the synthesized data as well
+            period = self.get_period(GLOBAL_CONFIG)
+            return math.ceil((now + GLOBAL_CONFIG['data_generator_word_delay']) / period) * period
+        else:
+            return now + GLOBAL_CONFIG['data_generator_word_delay']
+
+    def build_template(self, key, config):
+        ch_type = config['equipment'][self.ch_id][0]
+        if ch_type == 'a429rx':
+            return MessageTemplates.a429(self.ch_id, key, config['sample_data'])
+        else:
+            return MessageTemplates.disc(self.ch_id)
+
+    def prepare_templates(self, keys, config):
+        # the templates are held together with the sample data they were built of
+        sample_data, templates = self.templates
+        if sample_data is not config['sample_data']:
+            templates = dict()
+            self.templates = (config['sample_data'], templates)
+        for key in keys:
+            if key not in templates:
+                templates[key] = self.build_template(key, config)
+        return templates
+
+    def get_templates(self, mask, t, config):
+        # the list of the lines of the sample data is built once per subscribed bitmap and sample data,
+        # only the lines of the synthesized parameters are formatted for each point in time
+        sample_data = config['sample_data']
+        parameters = config['a429_parameters']
+        cached = self.cached.get(mask)
+        if cached == None or cached[0] is not sample_data or cached[1] is not parameters:
+            if config['equipment'][self.ch_id][0] == 'a429rx':
+                keys = Bitmap.items(mask)
+                synthesized = [key for key in keys if key in parameters]
             else:
-                return STAPHandler.get_err('CHANNEL_NOT_FOUND')
-                
-            try:
-                total_words = int(args[2])
-            except:
-                return STAPHandler.get_err('INV_WORDCOUNT_FORMAT')
-            
-            if total_words > GLOBAL_CONFIG['max_transmitex_words']:
-                return STAPHandler.get_err('INV_WORDCOUNT_RANGE')
-            
-            if len(args) != (total_words * 2) + 3:
-                return STAPHandler.get_err('INV_ARG_NO')
-                
-            for i in range(total_words):
-                try:
-                    label = int(args[3 + i * 2], 8)
-                except:
-                    return STAPHandler.get_err('INV_LABEL_FORMAT')
-                    
-                if label < 0 or label > 255:
-                    return STAPHandler.get_err('INV_LABEL_RANGE')
-                    
-                try:
-                    data = int(args[4 + i * 2], 16)
-                except:
-                    return STAPHandler.get_err('INV_DATA_FORMAT')
-                
-                if data < 0 or data > 0x7fffff:
-                    return STAPHandler.get_err('INV_DATA_RANGE')
-                
-            return b'ok'            
+                keys = [None]
+                synthesized = []
+            templates = self.prepare_templates(keys, config)
+            if len(self.cached) >= 1024:
+                # bitmaps not subscribed anymore are forgotten from time to time
+                self.cached = dict()
+            cached = (sample_data, parameters, [templates[key] for key in keys if key not in parameters and templates[key] != None], synthesized)
+            self.cached[mask] = cached
 
-        elif request == b'checksum,crc32,on':
-            self.crc32 = True
-            return b'ok'
-            
-        elif request == b'checksum,off':
-            self.crc32 = False
-            return b'ok'
-        
-        elif args[0] == b'checksum':
-            if len(args) < 2:
-                return STAPHandler.get_err('INV_ARG_NO')
+        if len(cached[3]) == 0:
+            return cached[2]
+        data = A429Parameters.get_data(t, parameters)
+        return cached[2] + [MessageTemplates.a429_word(self.ch_id, label, data[label]) for label in cached[3]]
 
-            if args[1] != b'crc32' and args[1] != b'off':
-                return STAPHandler.get_err('INV_CHECKSUM_MODE')
-                
-            if args[1] == b'crc32':
-                if len(args) != 3:
-                    return STAPHandler.get_err('INV_ARG_NO')
-                elif args[2] != b'on':
-                    return STAPHandler.get_err('INV_CRC32_MODE')
-            elif args[1] == b'off':
-                if len(args) != 2:
-                    return STAPHandler.get_err('INV_ARG_NO')
-            
-            return STAPHandler.get_err('UNKNOWN_ERROR')
-            
-        else:        
-            return STAPHandler.get_err('UNKNOWN_COMMAND')
-        
-    def handle(self):
-        Logger.info("Incoming connection from {}:{}.".format(self.client_address[0], self.client_address[1]))
+    def get_mask(self, member, subframe, config):
+        # the bitmaps are immutable values, the clients may replace them in the meantime
+        ch_type = config['equipment'][self.ch_id][0]
+        if ch_type == 'a429rx':
+            return member.labels
+        elif ch_type == 'a717rx':
+            params = member.handler.session.get(self.ch_id)
+            return params[subframe] if params != None else 0
+        else:
+            return 1
 
-        self.crc32 = False
-        self.session = dict()
-        self.buffer = b''
-        
-        self.should_run = True
-        data_thread = threading.Thread(target = self.data_generator, args = (self.request,))
-        data_thread.daemon = True
-        data_thread.start()
-        
-        while True:
-            try:
-                received = self.request.recv(1024) # may throw exception
-            except:
-                Logger.info('Error reading from the client {}:{}. Closing connection.'.format(self.client_address[0], self.client_address[1]))
-                self.should_run = False
-                return
+    def wake(self, deadline):
+        # the data are generated in the cycle of the topic only
+        pass
 
-            Logger.debug('Data received {}.'.format(received))
-            
-            if len(received) == 0:
-                Logger.info('Connection from the client {}:{} closed.'.format(self.client_address[0], self.client_address[1]))
-                self.should_run = False
-                return
-            
-            self.buffer += received
-            
-            # protection against too long requests
-            if len(self.buffer) > GLOBAL_CONFIG['max_input_buffer']:
-                # silent cut
-                Logger.info('Max buffer size reached ({}), forgetting current data.'.format(GLOBAL_CONFIG['max_input_buffer']))
-                self.buffer = b''
-            
-            # iterate over the buffer to find all commands
-            while True:
-                # find the first line break if any -> pos_nl
-                pos_r = self.buffer.find(b'\r')
-                pos_n = self.buffer.find(b'\n')
-                if pos_r >= 0 and pos_n >=0:
-                    pos_nl = pos_r if pos_r < pos_n else pos_n
-                else:
-                    pos_nl = pos_r if pos_r >= 0 else pos_n
-                    
-                # interpret as a command if there is a new-line sequence only
-                if pos_nl >= 0:
-                    request = self.buffer[0:pos_nl]
-                    
-                    pos = 0
-                    while pos < len(request):
-                        if request[pos] == 0x08:
-                            request = request[:(pos - 1) if pos > 0 else pos] + request[pos+1:]
-                            pos -= 1 if pos > 0 else 0
-                        else:
-                            pos += 1
-                    
-                    self.buffer = self.buffer[pos_nl+1:]
-
-                    # process the command if not empty only
-                    if len(request) > 0:
-                        # verify, whether a checksum is expected and validate it
-                        response = None
-                        if self.crc32:
-                            rpos = request.rfind(b',')
-                            if rpos < 0:
-                                response = STAPHandler.get_err('CHECKSUM_MISSING')
-                            else:
-                                try:
-                                    checksum_given = int(request[rpos+1:], 16)
-                                    checksum_calculated = zlib.crc32(request[0:rpos+1])
-                                    if checksum_given == checksum_calculated:
-                                        request = request[0:rpos]
-                                    else:
-                                        response = STAPHandler.get_err('INV_CHECKSUM_VALUE')
-                                except:
-                                    response = STAPHandler.get_err('INV_CHECKSUM_FORMAT')
-                        
-                        # an existing respone means that there was a problem with the request at the previous stage already
-                        # (checksum validation)
-                        # in this case, no further processing will be done
-                        if response == None:
-                            response = self.handle_request(request)
+    def get_members(self):
+        with self.server.topics_lock:
+            if len(self.members) == 0:
+                # the last client left, the topic is created again by the next subscription
+                if self.server.topics.get((self.ch_id, self.frequency)) is self:
+                    del self.server.topics[(self.ch_id, self.frequency)]
+                return None
+            return list(self.members)
 
-                        try:
-                            self.request.sendall(response)
-                            if self.crc32:
-                                self.request.sendall(STAPHandler.get_crc_bytes(response))
-                            self.request.sendall(b'\r\n')
-                        except:
-                            Logger.info('Error writing to the client {}:{}. Closing connection.'.format(self.client_address[0], self.client_address[1]))
-                            self.should_run = False
-                            return
+    def recover(self, deadline, now):
+        # the failed cycle is skipped, the members keep their subscriptions
+        return deadline + self.get_period(GLOBAL_CONFIG)
+
+    def fire(self, deadline, now):
+        members = self.get_members()
+        if members == None:
+            return None
+
+        # the whole cycle is generated from a single snapshot of the configuration
+        config = GLOBAL_CONFIG
+        # only the words of the subframe currently on the bus are generated
+        subframe = int(round(deadline)) % 4 if config['equipment'][self.ch_id][0] == 'a717rx' else None
+        ts = str(STAPProtocol.get_ts()).encode('ascii')
+        chunks = dict()
+        for member in members:
+            handler = member.handler
+            if not member.active or not handler.should_run:
+                continue
+            mask = self.get_mask(member, subframe, config)
+            if mask == 0:
+                continue
+            crc32 = handler.crc32
+            chunk = chunks.get((mask, crc32))
+            if chunk == None:
+                if subframe != None:
+                    chunk = b''.join(A717Frames.format(self.ch_id, subframe, int(round(deadline)), Bitmap.items(mask), crc32, config))
                 else:
-                    # no more commands in the buffer
-                    break
+                    chunk = b''.join(STAPProtocol.format_data(self.get_templates(mask, deadline, config), ts, crc32))
+                chunks[(mask, crc32)] = chunk
+            if len(chunk) > 0:
+                self.publish(handler, (chunk, ))
 
-class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    def __init__(self, hostandport, handler):
-        super().__init__(hostandport, handler)
-        self.daemon_threads = True
+        # the deadlines are derived from the previous ones to avoid accumulating a drift, short delays are caught up,
+        # in case of an overload, the missed cycles are skipped without leaving the grid of the deadlines
+        period = self.get_period(config)
+        deadline += period
+        if now - deadline > config['data_generator_max_lag']:
+            deadline += (int((now - deadline) / period) + 1) * period
+        return deadline
 
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        with open(sys.argv[1], 'r') as config_file:
-            try:
-                config_data = json.load(config_file)
-                if 'equipment' in config_data:
-                    equipment = {}
-                    for id, value in config_data['equipment'].items():
-                        equipment[int(id)] = value
-                    config_data['equipment'] = equipment
-                    
-                if 'sample_data' in config_data:
-                    sample_data = {}
-                    for id, value in config_data['sample_data'].items():
-                        sample_data[int(id)] = value
-                    config_data['sample_data'] = sample_data
-
-                GLOBAL_CONFIG.update(config_data)
-            except Exception as ex:
-                Logger.error('Failed to load the config file {} due to {}. Falling back to defaults.'.format(sys.argv[1], str(ex)))
-                
-    print(json.dumps(GLOBAL_CONFIG, indent=4))
+class DiscreteTopic(DataTopic):
+    # scheduler entry notifying the clients of the changes of a discrete input at the time of its edges, new subscribers
+    # are told the current state first, unchanged states are only repeated with a configured disc_refresh_interval
+    # (an entry is woken earlier by scheduling a new deadline, the replaced entry is dropped when it fires)
+    def __init__(self, server, ch_id, frequency):
+        super().__init__(server, ch_id, frequency)
+        self.lock = threading.Lock()
+        self.deadline = None
+        self.state = None
+        self.sent = None
+        self.notified = set()
 
-    Logger.info('Staring STAP server on {}:{}...'.format(GLOBAL_CONFIG['host'], GLOBAL_CONFIG['port']))
+    def get_first_deadline(self, now):
+        with self.lock:
+            self.deadline = now + GLOBAL_CONFIG['data_generator_word_delay']
+            return self.deadline
 
-    server = ThreadedTCPServer((GLOBAL_CONFIG['host'], GLOBAL_CONFIG['port']), STAPHandler)
+    def wake(self, deadline):
+        with self.lock:
+            if self.deadline != None and self.deadline <= deadline:
+                return
+            self.deadline = deadline
+        self.server.scheduler.schedule(self, deadline)
 
-    with server:
-        server_thread = threading.Thread(target=server.serve_forever)
-        server_thread.daemon = True
-        server_thread.start()
+    def recover(self, deadline, now):
+        # tried again in the cycle of the subscribed frequency, unless woken in the meantime
+        with self.lock:
+            if deadline != self.deadline:
+                return None
+            self.deadline = deadline + self.get_period(GLOBAL_CONFIG)
+            return self.deadline
+
+    def build_template(self, key, config):
+        return MessageTemplates.disc(self.ch_id, key)
+
+    def get_refresh_period(self, config):
+        interval = config['disc_refresh_interval']
+        if interval == None:
+            return None
+        return max(interval, 1.0 / self.frequency)
+
+    def fire(self, deadline, now):
+        with self.lock:
+            if deadline != self.deadline:
+                return None
+        members = self.get_members()
+        if members == None:
+            return None
+        members = [member for member in members if member.active and member.handler.should_run]
+
+        config = GLOBAL_CONFIG
+        # the state just after the edge, the lines carry the time of the edge
+        state = DiscreteInputs.get_state(self.ch_id, deadline + 1e-6, config)
+        refresh = self.get_refresh_period(config)
+        if state != self.state or (refresh != None and self.sent != None and deadline - self.sent >= refresh - 1e-6):
+            targets = members
+            self.notified = set(members)
+            self.state = state
+            self.sent = deadline
+        else:
+            targets = [member for member in members if member not in self.notified]
+            self.notified = set(members)
+
+        ts = str(int(deadline * 1000)).encode('ascii')
+        chunks = dict()
+        for member in targets:
+            handler = member.handler
+            crc32 = handler.crc32
+            chunk = chunks.get(crc32)
+            if chunk == None:
+                chunk = b''.join(STAPProtocol.format_data([self.prepare_templates([state], config)[state]], ts, crc32))
+                chunks[crc32] = chunk
+            self.publish(handler, (chunk, ))
+
+        # without any refresh, a constant input sleeps until the next subscription or change of the configuration,
+        # edges missed in an overload are skipped
+        if now - deadline > config['data_generator_max_lag']:
+            edge = DiscreteInputs.get_next_edge(self.ch_id, now, config)
+        else:
+            edge = DiscreteInputs.get_next_edge(self.ch_id, deadline + 1e-6, config)
+        if refresh != None:
+            edge = min(edge, self.sent + refresh) if edge != None else self.sent + refresh
+        with self.lock:
+            if deadline != self.deadline:
+                # woken in the meantime, the new entry takes over
+                return None
+            self.deadline = edge
+            return edge
+
+class OutputBuffer():
+    # collects the outgoing lines of a connection to write them with as few calls as possible
+    def __init__(self, write, scheduler):
+        self.write = write
+        self.scheduler = scheduler
+        self.chunks = []
+        self.size = 0
+        self.since = None
+        self.responses = False
+        self.scheduled = False
+        self.lock = threading.Lock()
+
+    def append(self, chunks, response = False):
+        with self.lock:
+            if self.since == None:
+                self.since = time.monotonic()
+            self.chunks.extend(chunks)
+            self.responses = self.responses or response
+            for chunk in chunks:
+                self.size += len(chunk)
+            if self.size >= GLOBAL_CONFIG['output_flush_size']:
+                self.flush_locked()
+
+    def flush_locked(self):
+        # output holding responses must not be dropped by the writer
+        if self.size > 0:
+            data = b''.join(self.chunks)
+            droppable = not self.responses
+            self.chunks = []
+            self.size = 0
+            self.since = None
+            self.responses = False
+            self.write(data, droppable)
+
+    def flush(self):
+        with self.lock:
+            self.flush_locked()
+
+    def flush_later(self):
+        # the pending output is written as soon as it is older than the configured latency,
+        # more lines may be collected in the meantime
+        latency = GLOBAL_CONFIG['output_flush_latency']
+        with self.lock:
+            if self.size == 0:
+                return
+            elif latency <= 0 or time.monotonic() - self.since >= latency:
+                self.flush_locked()
+                return
+            elif self.scheduled:
+                return
+            self.scheduled = True
+            deadline = self.since + latency
+        self.scheduler.schedule(self, deadline)
+
+    def fire(self, deadline, now):
+        # called by the scheduler once the latency of the pending output expired
+        with self.lock:
+            self.scheduled = False
+            try:
+                self.flush_locked()
+            except:
+                # the failure is reported by the next write attempt of the connection
+                self.chunks = []
+                self.size = 0
+                self.since = None
+                self.responses = False
+        return None
+
+    def recover(self, deadline, now):
+        with self.lock:
+            self.scheduled = False
+        return None
+
+class A429Transmitter(DataPublisher):
+    # scheduler entry sending the words transmitted by the clients over an ARINC 429 bus at the speed of the channel,
+    # the sent words are delivered to the clients subscribed to them on the receivers looped back to the transmitter
+    # (a word takes 32 bits followed by a gap of at least 4 bits)
+    word_rates = { 'high': 100000 / 36, 'low': 12500 / 36 }
+
+    def __init__(self, server, ch_id):
+        super().__init__()
+        self.server = server
+        self.ch_id = ch_id
+        self.queue = collections.deque()
+        self.bus_time = 0.0
+        self.scheduled = False
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def get_word_time(self):
+        speed = GLOBAL_CONFIG['equipment'][self.ch_id][1]
+        return 1.0 / A429Transmitter.word_rates.get(speed, A429Transmitter.word_rates['low'])
+
+    def enqueue(self, labels, data):
+        # the oldest waiting words make room for the new ones, unless the policy rejects the words exceeding the buffer
+        # (all or none), returns False if rejected
+        limit = GLOBAL_CONFIG['a429_tx_buffer']
+        with self.lock:
+            if len(self.queue) + len(labels) > limit and GLOBAL_CONFIG['a429_tx_overflow_policy'] == 'reject':
+                return False
+            self.queue.extend(zip(labels, data))
+            excess = len(self.queue) - limit
+            if excess > 0:
+                for i in range(excess):
+                    self.queue.popleft()
+                if self.dropped == 0:
+                    Logger.info('Transmit buffer of the channel {} full. Dropping the oldest words.', self.ch_id)
+                self.dropped += excess
+                Metrics.get().count('dropped', excess)
+            if self.scheduled:
+                return True
+            # an idle bus starts sending right away
+            self.scheduled = True
+            self.bus_time = max(self.bus_time, time.monotonic())
+            deadline = self.bus_time + self.get_word_time()
+        self.server.scheduler.schedule(self, deadline)
+        return True
+
+    def get_receivers(self):
+        config = GLOBAL_CONFIG
+        return [rx_id for rx_id in config['a429_loopback'].get(self.ch_id, []) \
+            if config['equipment'].get(rx_id, [None])[0] == 'a429rx']
+
+    def deliver(self, words):
+        # each word is formatted once per receiver, the subscriptions of the clients select from them
+        receivers = [(rx_id, [(label, MessageTemplates.a429_word(rx_id, label, data)) for label, data in words]) \
+            for rx_id in self.get_receivers()]
+        ts = str(STAPProtocol.get_ts()).encode('ascii')
+        for handler in list(self.server.clients):
+            if not handler.should_run:
+                continue
+            templates = []
+            for rx_id, formatted in receivers:
+                labels = handler.session.get(rx_id)
+                if labels:
+                    templates.extend(template for label, template in formatted if Bitmap.contains(labels, label))
+            if len(templates) > 0:
+                self.publish(handler, STAPProtocol.format_data(templates, ts, handler.crc32))
+
+    def fire(self, deadline, now):
+        # all the words sent completely in the meantime are taken at once,
+        # further ones are collected for at least the configured interval
+        word_time = self.get_word_time()
+        until = max(deadline, now)
+        words = []
+        with self.lock:
+            while len(self.queue) > 0 and self.bus_time + word_time <= until:
+                self.bus_time += word_time
+                words.append(self.queue.popleft())
+            if len(self.queue) > 0:
+                deadline = max(self.bus_time + word_time, now + GLOBAL_CONFIG['a429_tx_interval'])
+            else:
+                self.scheduled = False
+                deadline = None
+            # the dropped words are reported once the buffer has been emptied
+            dropped = self.dropped if deadline == None else 0
+            if dropped > 0:
+                self.dropped = 0
+
+        if dropped > 0:
+            Logger.info('Transmitter of the channel {} dropped {} words due to its full buffer.', self.ch_id, dropped)
+
+        if len(words) > 0:
+            self.deliver(words)
+        return deadline
+
+    def recover(self, deadline, now):
+        # the waiting words are sent in the next cycle
+        return now + GLOBAL_CONFIG['a429_tx_interval']
+
+class ChannelState():
+    # ownership and state of an output channel, shared by all the sessions of the server,
+    # read without locking (a single reference read), changed under the lock of the channel
+    # (channels configured as locked are owned by a simulated client outside of the server for ever,
+    # channels configured as owned are granted to the sessions at their start, while not owned by another one)
+    EXTERNAL = 'external'
+
+    def __init__(self, channel):
+        self.lock = threading.Lock()
+        self.owner = ChannelState.EXTERNAL if ChannelState.get_configured(channel) == 'locked' else None
+        self.value = 0
+
+    def is_output(channel):
+        return channel[0] == 'a429tx' or channel[0] == 'disc' and channel[1] == 'out'
+
+    def get_configured(channel):
+        # the state is the third item of the equipment of an output, if any
+        return channel[2] if ChannelState.is_output(channel) and len(channel) > 2 else None
+
+    def acquire(self, session):
+        with self.lock:
+            if self.owner == None:
+                self.owner = session
+            return self.owner is session
+
+    def release(self, session):
+        with self.lock:
+            if self.owner is session:
+                self.owner = None
+                return True
+            return False
+
+    def is_available(self, session):
+        owner = self.owner
+        return owner == None or owner is session
+
+    def put(self, session, value):
+        # the value is changed only while the channel is not owned by another session, returns False otherwise
+        with self.lock:
+            if not self.is_available(session):
+                return False
+            self.value = value
+            return True
+
+    def transmit(self, session, transmitter, labels, data):
+        # the words are queued while the owner cannot change, returns None if owned by another session,
+        # the result of the transmitter otherwise
+        with self.lock:
+            if not self.is_available(session):
+                return None
+            return transmitter.enqueue(labels, data)
+
+    def get_status(self, session):
+        owner = self.owner
+        if owner == None:
+            return 'free'
+        return 'owned' if owner is session else 'locked'
+
+class TraceReplay(DataPublisher):
+    # scheduler entry replaying a recorded bus trace to the subscribed clients, the trace is mapped into memory
+    # and read record by record, so that its size does not matter
+    # (8 bytes of the magic followed by records of a timestamp in microseconds, a channel ID, an address and the data:
+    # the label of ARINC 429 words, the subframe (bits 12-13) and word (bits 0-11) of ARINC 717 words, none of discrete lines)
+    magic = b'STAPTRC1'
+    record = struct.Struct('<QHHI')
+
+    # the replayed part of the trace is released from the memory of the process in windows of this size
+    window = 1 << 24
+
+    def __init__(self, server, path):
+        super().__init__()
+        self.server = server
+        self.path = path
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self.data, 'madvise'):
+            self.data.madvise(mmap.MADV_SEQUENTIAL)
+        if self.data[:len(TraceReplay.magic)] != TraceReplay.magic:
+            raise ValueError('Not a trace file')
+        self.count = (len(self.data) - len(TraceReplay.magic)) // TraceReplay.record.size
+        self.index = 0
+        self.released = 0
+        self.start = None
+        self.first_ts = self.get_record(0)[0] if self.count > 0 else 0
+
+    def get_record(self, index):
+        return TraceReplay.record.unpack_from(self.data, len(TraceReplay.magic) + index * TraceReplay.record.size)
+
+    def format(self, ch_id, address, data, config):
+        # returns the subscription key of the record and its template, None for records of unknown channels
+        channel = config['equipment'].get(ch_id)
+        if channel == None:
+            return None
+        elif channel[0] == 'a429rx':
+            label = address & 0xff
+            return label, MessageTemplates.a429_word(ch_id, label, data & 0x7fffff)
+        elif channel[0] == 'a717rx':
+            subframe, word = (address >> 12) & 3, address & 0xfff
+            return (subframe, word), MessageTemplates.build(b',%d,%d,%d,%04x' % (ch_id, subframe, word, data & 0xfff))
+        elif channel[0] == 'disc':
+            return None, MessageTemplates.disc(ch_id, data & 1)
+        return None
+
+    def is_subscribed(handler, ch_id, key, config):
+        params = handler.session.get(ch_id)
+        if params == None:
+            return False
+        channel = config['equipment'][ch_id]
+        if channel[0] == 'a429rx':
+            return Bitmap.contains(params, key)
+        elif channel[0] == 'a717rx':
+            return Bitmap.contains(params[key[0]], key[1])
+        return True
+
+    def deliver(self, records, config):
+        # the lines of a record are formatted once per checksum mode, when needed by a client
+        formatted = []
+        for due, ch_id, address, data in records:
+            result = self.format(ch_id, address, data, config)
+            if result != None:
+                formatted.append((ch_id, result[0], b'%d' % int(due * 1000), result[1], dict()))
+
+        for handler in list(self.server.clients):
+            if not handler.should_run:
+                continue
+            crc32 = handler.crc32
+            lines = []
+            for ch_id, key, ts, template, variants in formatted:
+                if TraceReplay.is_subscribed(handler, ch_id, key, config):
+                    line = variants.get(crc32)
+                    if line == None:
+                        line = STAPProtocol.format_data([template], ts, crc32)[0]
+                        variants[crc32] = line
+                    lines.append(line)
+            if len(lines) > 0:
+                self.publish(handler, lines)
+
+    def fire(self, deadline, now):
+        # all the due records are replayed in batches of a limited size, the timestamps are scaled by the speed,
+        # the speed 0 replays as fast as possible
+        config = GLOBAL_CONFIG
+        speed = config['replay_speed']
+        if self.start == None:
+            self.start = now
+
+        records = []
+        next_deadline = now
+        while len(records) < config['replay_batch']:
+            if self.index >= self.count:
+                if not config['replay_loop'] or self.count == 0:
+                    Logger.info('Replay of the trace {} finished.', self.path)
+                    next_deadline = None
+                    break
+                # the next loop starts right after the last record of the previous one
+                last_ts = self.get_record(self.count - 1)[0]
+                if speed > 0:
+                    self.start += (last_ts - self.first_ts) / 1e6 / speed
+                self.index = 0
+                self.released = 0
+
+            ts, ch_id, address, data = self.get_record(self.index)
+            due = self.start + (ts - self.first_ts) / 1e6 / speed if speed > 0 else now
+            if due > now:
+                next_deadline = due
+                break
+            records.append((due, ch_id, address, data))
+            self.index += 1
+
+        if len(records) > 0:
+            self.deliver(records, config)
+
+        if hasattr(self.data, 'madvise') and self.index * TraceReplay.record.size - self.released >= TraceReplay.window:
+            self.data.madvise(mmap.MADV_DONTNEED, self.released, TraceReplay.window)
+            self.released += TraceReplay.window
+        return next_deadline
+
+    def recover(self, deadline, now):
+        # the records of the failed batch are skipped, the replay goes on
+        return now
+
+class TrafficRecorder():
+    # appends the traffic of all the connections to a binary log, the handlers only queue the data,
+    # a background thread writes them and flushes the file periodically
+    # (8 bytes of the magic followed by records of a header and the data, the header holding a timestamp in microseconds
+    # of the clock of the data lines, a connection ID, the kind of the record and the length of the data)
+    magic = b'STAPREC1'
+    header = struct.Struct('<QIBI')
+
+    # kinds of the records, the data of a connection record is the address of the client
+    CONNECTED = 0
+    RECEIVED = 1
+    SENT = 2
+    DISCONNECTED = 3
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(TrafficRecorder.magic)
+        self.pending = collections.deque()
+        self.dropped = 0
+        self.connections = itertools.count(1)
+        self.should_run = True
+        self.event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='TrafficRecorder')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self, connection, kind, data):
+        # called by the handlers, appending to the deque is thread-safe without any lock,
+        # records exceeding the limit are dropped (counted without a lock, so the count is approximate)
+        if not self.should_run:
+            return
+        if len(self.pending) >= GLOBAL_CONFIG['record_queue_limit']:
+            if self.dropped == 0:
+                Logger.info('Record {} falls behind, dropping records.', self.path)
+            self.dropped += 1
+            return
+        self.pending.append((time.monotonic(), connection, kind, data))
+
+    def write_pending(self):
+        pack = TrafficRecorder.header.pack
+        chunks = []
+        while len(self.pending) > 0:
+            t, connection, kind, data = self.pending.popleft()
+            chunks.append(pack(int(t * 1e6), connection, kind, len(data)))
+            chunks.append(data)
+        if len(chunks) > 0:
+            self.file.write(b''.join(chunks))
+            self.file.flush()
+
+    def run(self):
+        while self.should_run:
+            self.event.wait(GLOBAL_CONFIG['record_flush_interval'])
+            try:
+                self.write_pending()
+            except Exception as ex:
+                Logger.error('Failed to write the record {} due to {}. Recording stopped.', self.path, str(ex))
+                self.should_run = False
+                self.pending.clear()
+
+    def close(self):
+        if self.should_run:
+            self.should_run = False
+            self.event.set()
+            self.thread.join()
+            self.write_pending()
+        self.file.close()
+        if self.dropped > 0:
+            Logger.info('{} records dropped from the record {}.', self.dropped, self.path)
+
+class OutputQueue():
+    # bounded queue of the output of a connection, written by a writer of its own so that a slow client stalls nobody else,
+    # data lines beyond the high-water mark are handled according to the overflow policy, responses are never dropped
+    def __init__(self, client_address, abort):
+        self.client_address = client_address
+        self.abort = abort
+        self.blocks = collections.deque()
+        self.size = 0
+        self.over_since = None
+        self.dropping = False
+        self.dropped_lines = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.wakeup = None
+
+    def is_full(self):
+        return self.size > GLOBAL_CONFIG['output_queue_limit']
+
+    def notify(self):
+        self.condition.notify_all()
+        if self.wakeup != None:
+            self.wakeup()
+
+    def drop(self, data):
+        if not self.dropping:
+            Logger.info('Output of the client {}:{} exceeds {} bytes, dropping data lines.', self.client_address[0], self.client_address[1], GLOBAL_CONFIG['output_queue_limit'])
+            self.dropping = True
+        lines = data.count(b'\n')
+        self.dropped_lines += lines
+        Metrics.get().count('dropped', lines)
+
+    def put(self, data, droppable):
+        with self.condition:
+            if self.closed:
+                raise ConnectionError('Output queue closed')
+
+            limit = GLOBAL_CONFIG['output_queue_limit']
+            policy = GLOBAL_CONFIG['output_overflow_policy']
+            if droppable and self.size + len(data) > limit:
+                if policy == 'drop-oldest':
+                    # the oldest data lines make room for the new ones
+                    blocks = collections.deque()
+                    for block, block_droppable in self.blocks:
+                        if block_droppable and self.size + len(data) > limit:
+                            self.size -= len(block)
+                            self.drop(block)
+                        else:
+                            blocks.append((block, block_droppable))
+                    self.blocks = blocks
+                if policy != 'disconnect' and self.size + len(data) > limit:
+                    self.drop(data)
+                    return
+
+            self.blocks.append((data, droppable))
+            self.size += len(data)
+            if self.is_full():
+                now = time.monotonic()
+                if self.over_since == None:
+                    self.over_since = now
+                elif policy == 'disconnect' and now - self.over_since > GLOBAL_CONFIG['output_disconnect_timeout']:
+                    Logger.info('Output of the client {}:{} exceeds {} bytes for too long. Closing connection.', self.client_address[0], self.client_address[1], limit)
+                    self.close_locked(True)
+                    self.abort()
+                    return
+            self.notify()
+
+    def take(self, block = False):
+        # returns all the queued output at once, None if there is none (or the queue is closed and empty while blocking)
+        with self.condition:
+            while block and len(self.blocks) == 0 and not self.closed:
+                self.condition.wait()
+            if len(self.blocks) == 0:
+                return None
+            data = b''.join([block for block, droppable in self.blocks])
+            self.blocks.clear()
+            self.size = 0
+            self.over_since = None
+            self.dropping = False
+            self.notify()
+            return data
+
+    def wait_writable(self):
+        # the requests of a client are not read while its output exceeds the high-water mark
+        with self.condition:
+            while self.is_full() and not self.closed:
+                self.condition.wait()
+
+    def close_locked(self, discard):
+        # output still queued is written by the writer before it quits, unless discarded
+        self.closed = True
+        if discard:
+            self.blocks.clear()
+            self.size = 0
+        self.notify()
+
+    def close(self, discard = False):
+        with self.condition:
+            self.close_locked(discard)
+
+class LineFramer():
+    # splits the received data into requests, the consumed data are dropped once per received chunk only
+    delimiter = re.compile(b'[\r\n]')
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.pos = 0
+
+    def feed(self, data):
+        self.buffer += data
+
+    def get_pending(self):
+        return len(self.buffer) - self.pos
+
+    def clear(self):
+        self.buffer = bytearray()
+        self.pos = 0
+
+    def apply_backspaces(request):
+        # each backspace removes the preceding character, if any
+        parts = request.split(b'\x08')
+        result = bytearray(parts[0])
+        for part in parts[1:]:
+            del result[-1:]
+            result += part
+        return bytes(result)
+
+    def read_lines(self):
+        # yields the complete lines in the buffer, a single search finds the next line break of any kind
+        buffer = self.buffer
+        search = LineFramer.delimiter.search
+        view = memoryview(buffer)
+        try:
+            while True:
+                match = search(buffer, self.pos)
+                if match == None:
+                    break
+                end = match.start()
+                request = bytes(view[self.pos:end])
+                self.pos = end + 1
+                if b'\x08' in request:
+                    request = LineFramer.apply_backspaces(request)
+                yield request
+        finally:
+            view.release()
+
+        del buffer[:self.pos]
+        self.pos = 0
+
+class STAPError(Exception):
+    # raised by the request handlers to respond with the error of the given ID
+    def __init__(self, id: str):
+        super().__init__(id)
+        self.id = id
+
+class STAPCommand():
+    # registry of the request handlers, indexed by the command verb
+    registry = dict()
+
+    def __init__(self, handler, min_args, max_args):
+        self.handler = handler
+        self.min_args = min_args
+        self.max_args = max_args
+
+    def register(verbs, min_args, max_args = None):
+        # decorator of a request handler accepting the given number of arguments (unlimited if no maximum is given)
+        def decorator(handler):
+            for verb in verbs:
+                STAPCommand.registry[verb] = STAPCommand(handler, min_args, max_args)
+            return handler
+        return decorator
+
+class STAPArgs():
+    # validation of the request arguments shared by all the request handlers, raising STAPError on failures
+    # the channels by the canonical forms of their IDs, with the equipment they were built of
+    channels = (None, dict())
+
+    # octal labels in their usual forms, to be decoded by a lookup in bulk transmissions
+    labels = { form % label: label for label in range(256) for form in (b'%o', b'%02o', b'%03o') }
+
+    def get_channel(arg, config):
+        # the canonical channel IDs are looked up in a table built once per equipment configuration
+        equipment = config['equipment']
+        channels = STAPArgs.channels
+        if channels[0] is not equipment:
+            channels = (equipment, { str(ch_id).encode('ascii'): (ch_id, channel) for ch_id, channel in equipment.items() })
+            STAPArgs.channels = channels
+
+        result = channels[1].get(arg)
+        if result != None:
+            return result
+
+        try:
+            ch_id = int(arg)
+        except:
+            raise STAPError('INV_CHANNEL_FORMAT')
+
+        if ch_id not in equipment:
+            raise STAPError('CHANNEL_NOT_FOUND')
+        return ch_id, equipment[ch_id]
+
+    def check_type(channel, ch_type, error, direction = None):
+        if channel[0] != ch_type or (direction != None and channel[1] != direction):
+            raise STAPError(error)
+
+    def get_label(arg, allow_all = False):
+        if allow_all and arg == b'all':
+            return arg
+        try:
+            label = int(arg, 8)
+        except:
+            raise STAPError('INV_LABEL_FORMAT')
+        if label < 0 or label > 255:
+            raise STAPError('INV_LABEL_RANGE')
+        return label
+
+    def get_data(arg):
+        try:
+            data = int(arg, 16)
+        except:
+            raise STAPError('INV_DATA_FORMAT')
+        if data < 0 or data > 0x7fffff:
+            raise STAPError('INV_DATA_RANGE')
+        return data
+
+    def get_words(label_args, data_args):
+        # decodes all the label/data pairs of a bulk transmission at once, by conversions and range checks over whole lists,
+        # the pairs are validated one by one only to report the first failing one
+        labels = list(map(STAPArgs.labels.get, label_args))
+        if None not in labels:
+            try:
+                data = list(map(int, data_args, itertools.repeat(16, len(data_args))))
+                if len(data) == 0 or (min(data) >= 0 and max(data) <= 0x7fffff):
+                    return labels, data
+            except ValueError:
+                pass
+
+        labels = []
+        data = []
+        for label_arg, data_arg in zip(label_args, data_args):
+            labels.append(STAPArgs.get_label(label_arg))
+            data.append(STAPArgs.get_data(data_arg))
+        return labels, data
+
+    def get_frequency(arg, config):
+        try:
+            frequency = int(arg)
+        except:
+            raise STAPError('INV_FREQ_FORMAT')
+        if frequency < config['min_frequency'] or frequency > config['max_frequency']:
+            raise STAPError('INV_FREQUENCY_RANGE')
+        return frequency
+
+    def get_subframe_and_word(channel, subframe_arg, word_arg):
+        # both formats are verified before the ranges
+        try:
+            subframe = subframe_arg if subframe_arg == b'all' else int(subframe_arg)
+        except:
+            raise STAPError('INV_SUBFRAME_FORMAT')
+        
+        try:
+            word = word_arg if word_arg == b'all' else int(word_arg)
+        except:
+            raise STAPError('INV_WORD_FORMAT')
+        
+        if subframe != b'all' and (subframe < 0 or subframe >= 4):
+            raise STAPError('INV_SUFRAME_RANGE')
+            
+        if word != b'all' and (word < 0 or word >= channel[1]):
+            raise STAPError('INV_WORD_RANGE')
+        return subframe, word
+
+class STAPProtocol():
+    # transport independent part of a client connection, shared by the threading and asyncio serving modes
+    status_equipment = None
+    status_version = None
+    status_prefix = b''
+    status_parts = []
+
+    def get_ts():
+        return int(time.monotonic() * 1000)
+    
+    def get_err(id: str, config):
+        Metrics.get().count(('errors', id))
+        if config['error_codes'] and id in GLOBAL_ERRORS:
+            if config['error_messages']:
+                return 'err,{},{}'.format(GLOBAL_ERRORS[id][0], GLOBAL_ERRORS[id][1]).encode('ascii')
+            else:
+                return 'err,{}'.format(GLOBAL_ERRORS[id][0]).encode('ascii')
+        else:
+            return b'err'
+    
+    def get_crc_bytes(data):
+        # the separator is chained to the running checksum of the data, instead of copying the data
+        return b',%08x' % zlib.crc32(b',', zlib.crc32(data))
+
+    def open_session(self):
+        self.crc32 = False
+        self.session = dict()
+        self.status_cache = dict()
+        self.subscriptions = dict()
+        self.framer = LineFramer()
+        self.output = OutputBuffer(self.send, self.scheduler)
+        self.queue = OutputQueue(self.client_address, self.abort)
+        self.should_run = True
+        self.server.clients.add(self)
+        Metrics.get().count('connections')
+
+        # the outputs configured as owned are granted to the session, unless owned by another one already
+        self.owned = set()
+        for ch_id, channel in GLOBAL_CONFIG['equipment'].items():
+            if ChannelState.get_configured(channel) == 'owned' and self.server.get_channel_state(ch_id).acquire(self):
+                self.owned.add(ch_id)
+        self.recorder = self.server.recorder
+        if self.recorder != None:
+            self.connection = next(self.recorder.connections)
+            self.recorder.record(self.connection, TrafficRecorder.CONNECTED, '{}:{}'.format(self.client_address[0], self.client_address[1]).encode())
+
+    def close_session(self):
+        self.should_run = False
+        self.server.clients.discard(self)
+        for ch_id, frequency in list(self.subscriptions):
+            self.unsubscribe(ch_id, frequency)
+        for ch_id in self.owned:
+            self.server.get_channel_state(ch_id).release(self)
+        self.owned.clear()
+        self.queue.close()
+        if self.recorder != None:
+            self.recorder.record(self.connection, TrafficRecorder.DISCONNECTED, b'')
+        if self.queue.dropped_lines > 0:
+            Logger.info('{} data lines to the client {}:{} have been dropped.', self.queue.dropped_lines, self.client_address[0], self.client_address[1])
+
+    def send(self, data, droppable):
+        # the output is handed over to the writer of the connection, never blocking
+        Metrics.get().count('sent', len(data))
+        if self.recorder != None:
+            self.recorder.record(self.connection, TrafficRecorder.SENT, data)
+        self.queue.put(data, droppable)
+
+    def abort(self):
+        # closes the connection at once, dropping the pending output, the transports override it
+        # (without a connection, e.g. in the benchmarks, there is nothing to close)
+        pass
+
+    def send_line(self, message):
+        # the line is buffered only, it is written by the next flush of the output
+        if self.crc32:
+            self.output.append((message, STAPProtocol.get_crc_bytes(message), b'\r\n'), True)
+        else:
+            self.output.append((message, b'\r\n'), True)
+
+    def subscribe(self, ch_id, frequency = None):
+        # returns the scheduler entry of the channel and frequency, creates it if not yet existing
+        subscription = self.subscriptions.get((ch_id, frequency))
+        if subscription == None:
+            subscription = DataSubscription(self, ch_id, frequency)
+            self.subscriptions[(ch_id, frequency)] = subscription
+            self.server.join_topic(subscription)
+        return subscription
+
+    def unsubscribe(self, ch_id, frequency = None):
+        subscription = self.subscriptions.pop((ch_id, frequency), None)
+        if subscription != None:
+            subscription.cancel()
+            self.server.leave_topic(subscription)
+
+    def add_labels(self, ch_id, labels, frequency):
+        # the labels are given as a bitmap, those subscribed at another frequency already are moved to the new one
+        self.remove_labels(ch_id, labels)
+        self.session[ch_id] = self.session.get(ch_id, 0) | labels
+        subscription = self.subscribe(ch_id, frequency)
+        subscription.labels |= labels
+
+    def remove_labels(self, ch_id, labels):
+        # the session holds all the subscribed labels of the channel, the subscriptions those of their frequency
+        if (self.session.get(ch_id, 0) & labels) == 0:
+            return
+        self.session[ch_id] &= ~labels
+        for (sub_ch_id, frequency), subscription in list(self.subscriptions.items()):
+            if sub_ch_id == ch_id and (subscription.labels & labels) != 0:
+                subscription.labels &= ~labels
+                if subscription.labels == 0:
+                    self.unsubscribe(ch_id, frequency)
+        
+    def format_data(templates, ts, crc32):
+        # only the timestamp (and the checksum) is added to the prepared lines
+        head = b'data,' + ts
+        if crc32:
+            # the checksum of the common beginning of the lines is calculated once only
+            head_crc = zlib.crc32(ts, MessageTemplates.data_crc)
+            crc32 = zlib.crc32
+            return [head + suffix + b'%08x\r\n' % crc32(suffix, head_crc) for suffix, suffix_nl in templates]
+        else:
+            return [head + suffix_nl for suffix, suffix_nl in templates]
+
+    def handle_request(self, request):
+        # a single lookup finds the handler of the command, the number of arguments is verified in advance,
+        # the request is processed with a single snapshot of the configuration
+        self.config = GLOBAL_CONFIG
+        args = request.split(b',')
+        command = STAPCommand.registry.get(args[0])
+        if command == None:
+            return STAPProtocol.get_err('UNKNOWN_COMMAND', self.config)
+
+        # the processing time is measured per command verb
+        start = time.perf_counter()
+        try:
+            if len(args) - 1 < command.min_args or (command.max_args != None and len(args) - 1 > command.max_args):
+                return STAPProtocol.get_err('INV_ARG_NO', self.config)
+            return command.handler(self, args)
+        except STAPError as error:
+            return STAPProtocol.get_err(error.id, self.config)
+        finally:
+            Metrics.get().observe(('requests', args[0]), time.perf_counter() - start)
+
+    @STAPCommand.register([b'diag'], 0, 0)
+    def do_diag(self, args):
+        return Metrics.format_diag(self.server)
+
+    def format_channel(ch_id, channel):
+        return channel[0].encode('ascii') + b'{' + b','.join([str(item).encode('ascii') for item in [ch_id] + channel[1:]]) + b'}'
+
+    def get_status_parts(config):
+        # the equipment is formatted once per equipment configuration and version, the outputs with a state in all the states
+        # (as the state differs by the session)
+        equipment = config['equipment']
+        version = config['stap_version']
+        if STAPProtocol.status_equipment is not equipment or STAPProtocol.status_version != version:
+            parts = []
+            for ch_id, channel in equipment.items():
+                if ChannelState.get_configured(channel) != None:
+                    parts.append((ch_id, { state: STAPProtocol.format_channel(ch_id, channel[:2] + [state] + channel[3:]) for state in ['free', 'owned', 'locked'] }))
+                else:
+                    parts.append(STAPProtocol.format_channel(ch_id, channel))
+            STAPProtocol.status_prefix = b'status,' + version.encode('ascii') + b',equipment{'
+            STAPProtocol.status_parts = parts
+            STAPProtocol.status_equipment = equipment
+            STAPProtocol.status_version = version
+        return STAPProtocol.status_prefix, STAPProtocol.status_parts
+
+    def format_session(ch_id, params, config):
+        # all the subscriptions of a channel, empty if there are none
+        ch_type = config['equipment'][ch_id][0]
+        if ch_type == 'a429rx':
+            return b','.join([b'a429{%d,%o}' % (ch_id, label) for label in Bitmap.items(params)])
+        elif ch_type == 'a717rx':
+            return b','.join([b'a717{%d,%d,%d}' % (ch_id, subframe, word) for subframe in range(len(params)) for word in Bitmap.items(params[subframe])])
+        elif ch_type == 'disc':
+            return b'disc{%d,%s}' % (ch_id, str(params).encode('ascii'))
+        return b''
+
+    @STAPCommand.register([b'status'], 0, 0)
+    def do_status(self, args):
+        # the subscriptions of a channel are formatted again only if they changed since the last status
+        # (keyed by the bitmaps, the lists of the ARINC 717 bitmaps are mutable so a copy is kept)
+        cache = dict()
+        parts = []
+        for ch_id, params in self.session.items():
+            key = tuple(params) if isinstance(params, list) else params
+            cached = self.status_cache.get(ch_id)
+            if cached == None or cached[0] != key:
+                cached = (key, STAPProtocol.format_session(ch_id, params, self.config))
+            cache[ch_id] = cached
+            if len(cached[1]) > 0:
+                parts.append(cached[1])
+        self.status_cache = cache
+
+        prefix, equipment = STAPProtocol.get_status_parts(self.config)
+        equipment = [part if isinstance(part, bytes) else part[1][self.server.get_channel_state(part[0]).get_status(self)] for part in equipment]
+        return prefix + b','.join(equipment) + b'},session{' + b','.join(parts) + b'}'
+
+    @STAPCommand.register([b'add'], 2, 3)
+    def do_add(self, args):
+        if args[1] == b'disc':
+            ch_id, channel = STAPArgs.get_channel(args[2], self.config)
+            STAPArgs.check_type(channel, 'disc', 'INV_CHANNEL_TYPE_DISC')
+            STAPArgs.check_type(channel, 'disc', 'INV_CHANNEL_TYPE_DISC_IN', 'in')
+
+            frequency = STAPArgs.get_frequency(args[3] if len(args) == 4 else None, self.config)
+            if ch_id in self.session:
+                return STAPProtocol.get_err('DISC_ALREADY_SUBS', self.config)
+
+            self.session[ch_id] = frequency
+            self.subscribe(ch_id, frequency)
+            return b'ok'
+        
+        elif args[1] == b'generic':
+            return STAPProtocol.get_err('GENERIC_UNSUPPORTED', self.config)
+
+        ch_id, channel = STAPArgs.get_channel(args[1], self.config)
+        if channel[0] == 'a429rx':
+            label = STAPArgs.get_label(args[2], True)
+
+            # optional frequency, the default generator interval applies otherwise
+            frequency = STAPArgs.get_frequency(args[3], self.config) if len(args) == 4 else None
+            
+            if label == b'all':
+                self.add_labels(ch_id, Bitmap.full(256), frequency)
+            else:
+                if Bitmap.contains(self.session.get(ch_id, 0), label):
+                    return STAPProtocol.get_err('LABEL_ALREADY_SUBS', self.config)
+                else:
+                    self.add_labels(ch_id, 1 << label, frequency)
+            
+            return b'ok'
+            
+        elif channel[0] == 'a717rx':
+            subframe, word = STAPArgs.get_subframe_and_word(channel, args[2], args[3] if len(args) == 4 else None)
+                
+            if ch_id not in self.session:
+                # one bitmap of the words per subframe
+                self.session[ch_id] = [0, 0, 0, 0]
+                self.subscribe(ch_id)
+            
+            params = self.session[ch_id]
+            words = Bitmap.full(channel[1]) if word == b'all' else 1 << word
+            if subframe == b'all':
+                # in case of 'all' approach, no existing subscription will be checked
+                for subframe in range(4):
+                    params[subframe] |= words
+            else:
+                if word == b'all':
+                    # in case of 'all' approach, no existing subscription will be checked
+                    params[subframe] |= words
+                else:
+                    if Bitmap.contains(params[subframe], word):
+                        return STAPProtocol.get_err('WORD_ALREADY_SUBS', self.config)
+                    else:
+                        params[subframe] |= words
+            return b'ok'
+
+        return STAPProtocol.get_err('CHANNEL_NOT_FOUND', self.config)
+
+    @STAPCommand.register([b'remove'], 2, 3)
+    def do_remove(self, args):
+        if args[1] == b'disc':
+            ch_id, channel = STAPArgs.get_channel(args[2], self.config)
+            STAPArgs.check_type(channel, 'disc', 'INV_CHANNEL_TYPE_DISC')
+            STAPArgs.check_type(channel, 'disc', 'INV_CHANNEL_TYPE_DISC_IN', 'in')
+
+            if ch_id in self.session:
+                self.unsubscribe(ch_id, self.session.pop(ch_id))
+                return b'ok'
+            else:
+                return STAPProtocol.get_err('DISC_NOT_SUBS', self.config)
+        
+        elif args[1] == b'generic':
+            return STAPProtocol.get_err('GENERIC_UNSUPPORTED', self.config)
+
+        ch_id, channel = STAPArgs.get_channel(args[1], self.config)
+        if channel[0] == 'a429rx':
+            label = STAPArgs.get_label(args[2], True)
+            
+            if label == b'all':
+                self.remove_labels(ch_id, Bitmap.full(256))
+                self.session[ch_id] = 0
+            else:
+                if Bitmap.contains(self.session.get(ch_id, 0), label):
+                    self.remove_labels(ch_id, 1 << label)
+                else:
+                    return STAPProtocol.get_err('LABEL_NOT_SUBS', self.config)
+            
+            return b'ok'
+            
+        elif channel[0] == 'a717rx':
+            subframe, word = STAPArgs.get_subframe_and_word(channel, args[2], args[3] if len(args) == 4 else None)
+
+            if subframe == b'all':
+                # in case of 'all' approach, no existing subscription will be checked
+                if ch_id in self.session:
+                    if word == b'all':
+                        del self.session[ch_id]
+                        self.unsubscribe(ch_id)
+                    else:
+                        for subframe in range(4):
+                            self.session[ch_id][subframe] &= ~(1 << word)
+            else:
+                if word == b'all':
+                    # in case of 'all' approach, no existing subscription will be checked
+                    if ch_id in self.session:
+                        self.session[ch_id][subframe] = 0
+                else:
+                    if ch_id in self.session and Bitmap.contains(self.session[ch_id][subframe], word):
+                        self.session[ch_id][subframe] &= ~(1 << word)
+                    else:
+                        return STAPProtocol.get_err('WORD_NOT_SUBS', self.config)
+
+            return b'ok'
+
+        return STAPProtocol.get_err('CHANNEL_NOT_FOUND', self.config)
+        
+    @STAPCommand.register([b'lock', b'release'], 1, 1)
+    def do_lock(self, args):
+        ch_id, channel = STAPArgs.get_channel(args[1], self.config)
+        if not ChannelState.is_output(channel):
+            return STAPProtocol.get_err('INV_CHANNEL_TYPE_OUTPUT', self.config)
+
+        state = self.server.get_channel_state(ch_id)
+        if args[0] == b'lock':
+            if not state.acquire(self):
+                return STAPProtocol.get_err('CHANNEL_LOCKED', self.config)
+            self.owned.add(ch_id)
+        else:
+            if not state.release(self):
+                return STAPProtocol.get_err('CHANNEL_NOT_OWNED' if state.owner == None else 'CHANNEL_LOCKED', self.config)
+            self.owned.discard(ch_id)
+        return b'ok'
+
+    def transmit(self, ch_id, labels, data):
+        # outputs owned by another session cannot be used
+        result = self.server.get_channel_state(ch_id).transmit(self, self.server.get_transmitter(ch_id), labels, data)
+        if result == None:
+            raise STAPError('CHANNEL_LOCKED')
+        return result
+                
+    @STAPCommand.register([b'transmit'], 3, 3)
+    def do_transmit(self, args):
+        ch_id, channel = STAPArgs.get_channel(args[1], self.config)
+        STAPArgs.check_type(channel, 'a429tx', 'INV_CHANNEL_TYPE_A429TX')
+        label = STAPArgs.get_label(args[2])
+        data = STAPArgs.get_data(args[3])
+        if not self.transmit(ch_id, [ label ], [ data ]):
+            return STAPProtocol.get_err('TX_BUFFER_FULL', self.config)
+        return b'ok'            
+
+    @STAPCommand.register([b'put'], 2, 2)
+    def do_put(self, args):
+        ch_id, channel = STAPArgs.get_channel(args[1], self.config)
+        STAPArgs.check_type(channel, 'disc', 'INV_CHANNEL_TYPE_DISC')
+        STAPArgs.check_type(channel, 'disc', 'INV_CHANNEL_TYPE_DISC_OUT', 'out')
+
+        if args[2] == b'0' or args[2] == b'1':
+            if not self.server.get_channel_state(ch_id).put(self, int(args[2])):
+                return STAPProtocol.get_err('CHANNEL_LOCKED', self.config)
+            return b'ok'
+        else:
+            return STAPProtocol.get_err('INV_STATE_VALUE', self.config)
+
+    @STAPCommand.register([b'get'], 1, 1)
+    def do_get(self, args):
+        ch_id, channel = STAPArgs.get_channel(args[1], self.config)
+        STAPArgs.check_type(channel, 'disc', 'INV_CHANNEL_TYPE_DISC')
+        # the state of an output is the one put last, the one of an input follows its pattern
+        if channel[1] == 'out':
+            value = self.server.get_channel_state(ch_id).value
+        else:
+            value = DiscreteInputs.get_state(ch_id, time.monotonic(), self.config)
+        return b'data,' + str(STAPProtocol.get_ts()).encode('ascii') + b',' + args[1] + b',%d' % value
+
+    @STAPCommand.register([b'transmitex'], 2)
+    def do_transmitex(self, args):
+        ch_id, channel = STAPArgs.get_channel(args[1], self.config)
+        STAPArgs.check_type(channel, 'a429tx', 'INV_CHANNEL_TYPE_A429TX')
+            
+        try:
+            total_words = int(args[2])
+        except:
+            return STAPProtocol.get_err('INV_WORDCOUNT_FORMAT', self.config)
+        
+        if total_words > self.config['max_transmitex_words']:
+            return STAPProtocol.get_err('INV_WORDCOUNT_RANGE', self.config)
+        
+        if len(args) != (total_words * 2) + 3:
+            return STAPProtocol.get_err('INV_ARG_NO', self.config)
+            
+        labels, data = STAPArgs.get_words(args[3::2], args[4::2])
+        if not self.transmit(ch_id, labels, data):
+            return STAPProtocol.get_err('TX_BUFFER_FULL', self.config)
+        return b'ok'            
+
+    @STAPCommand.register([b'checksum'], 1)
+    def do_checksum(self, args):
+        if args[1] == b'crc32':
+            if len(args) != 3:
+                return STAPProtocol.get_err('INV_ARG_NO', self.config)
+            elif args[2] != b'on':
+                return STAPProtocol.get_err('INV_CRC32_MODE', self.config)
+            self.crc32 = True
+            return b'ok'
+
+        elif args[1] == b'off':
+            if len(args) != 2:
+                return STAPProtocol.get_err('INV_ARG_NO', self.config)
+            self.crc32 = False
+            return b'ok'
+
+        return STAPProtocol.get_err('INV_CHECKSUM_MODE', self.config)
+        
+    def process_input(self, received):
+        # returns False if the connection shall be closed
+        Metrics.get().count('received', len(received))
+        if self.recorder != None:
+            self.recorder.record(self.connection, TrafficRecorder.RECEIVED, received)
+        self.framer.feed(received)
+        config = GLOBAL_CONFIG
+
+        # iterate over the buffer to find all commands
+        for request in self.framer.read_lines():
+            # process the command if not empty only
+            if len(request) > 0:
+                # verify, whether a checksum is expected and validate it
+                response = None
+                if self.crc32:
+                    rpos = request.rfind(b',')
+                    if rpos < 0:
+                        response = STAPProtocol.get_err('CHECKSUM_MISSING', config)
+                    else:
+                        try:
+                            checksum_given = int(request[rpos+1:], 16)
+                            checksum_calculated = zlib.crc32(memoryview(request)[0:rpos+1])
+                            if checksum_given == checksum_calculated:
+                                request = request[0:rpos]
+                            else:
+                                response = STAPProtocol.get_err('INV_CHECKSUM_VALUE', config)
+                        except:
+                            response = STAPProtocol.get_err('INV_CHECKSUM_FORMAT', config)
+                
+                # an existing respone means that there was a problem with the request at the previous stage already
+                # (checksum validation)
+                # in this case, no further processing will be done
+                if response == None:
+                    response = self.handle_request(request)
+
+                try:
+                    self.send_line(response)
+                except:
+                    Logger.info('Error writing to the client {}:{}. Closing connection.', self.client_address[0], self.client_address[1])
+                    return False
+
+        # protection against too long requests, only the incomplete request is left in the buffer
+        if self.framer.get_pending() > config['max_input_buffer']:
+            # silent cut
+            Logger.info('Max buffer size reached ({}), forgetting current data.', config['max_input_buffer'])
+            self.framer.clear()
+
+        # no more commands in the buffer, all the responses are written at once
+        try:
+            self.output.flush()
+        except:
+            Logger.info('Error writing to the client {}:{}. Closing connection.', self.client_address[0], self.client_address[1])
+            return False
+        return True
+
+class STAPHandler(STAPProtocol, socketserver.BaseRequestHandler):
+    def abort(self):
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except:
+            pass
+
+    def stop_reading(self):
+        try:
+            self.request.shutdown(socket.SHUT_RD)
+        except:
+            pass
+
+    def write_output(self):
+        # writer thread of the connection, a blocked client blocks this thread only
+        while True:
+            data = self.queue.take(True)
+            if data == None:
+                return
+            try:
+                self.request.sendall(data)
+            except:
+                if self.should_run:
+                    Logger.info('Error writing to the client {}:{}. Closing connection.', self.client_address[0], self.client_address[1])
+                    self.should_run = False
+                    self.abort()
+                return
+
+    def handle(self):
+        Logger.info("Incoming connection from {}:{}.", self.client_address[0], self.client_address[1])
+
+        self.scheduler = self.server.scheduler
+        self.thread = threading.current_thread()
+        self.open_session()
+
+        self.writer_thread = threading.Thread(target=self.write_output, name=threading.current_thread().name + ' writer')
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+        
+        while True:
+            self.queue.wait_writable()
+            try:
+                received = self.request.recv(1024) # may throw exception
+            except:
+                Logger.info('Error reading from the client {}:{}. Closing connection.', self.client_address[0], self.client_address[1])
+                self.should_run = False
+                return
+
+            Logger.debug('Data received {}.', received)
+            
+            if len(received) == 0:
+                Logger.info('Connection from the client {}:{} closed.', self.client_address[0], self.client_address[1])
+                self.should_run = False
+                return
+            
+            if not self.process_input(received):
+                self.should_run = False
+                return
+
+    def finish(self):
+        self.close_session()
+        # the pending output is written before the connection is closed, unless the client does not take it
+        self.writer_thread.join(GLOBAL_CONFIG['output_disconnect_timeout'])
+        Metrics.retire()
+
+class AsyncSTAPHandler(STAPProtocol):
+    def __init__(self, reader, writer, server):
+        self.reader = reader
+        self.writer = writer
+        self.server = server
+        self.client_address = writer.get_extra_info('peername')
+
+    def abort(self):
+        self.writer.transport.abort()
+
+    async def wait_output(self, condition):
+        # the queue signals every change of its state, all the output coroutines of the connection run on the event loop
+        while True:
+            self.output_event.clear()
+            if condition():
+                return
+            await self.output_event.wait()
+
+    async def write_output(self):
+        # writer task of the connection, the transport is drained before more output is taken
+        while True:
+            await self.wait_output(lambda: len(self.queue.blocks) > 0 or self.queue.closed)
+            data = self.queue.take()
+            if data == None:
+                return
+            try:
+                self.writer.write(data)
+                await self.writer.drain()
+            except Exception:
+                if self.should_run:
+                    Logger.info('Error writing to the client {}:{}. Closing connection.', self.client_address[0], self.client_address[1])
+                    self.should_run = False
+                    self.abort()
+                return
+
+    async def handle(self):
+        Logger.info("Incoming connection from {}:{}.", self.client_address[0], self.client_address[1])
+
+        self.scheduler = self.server.scheduler
+        self.open_session()
+
+        self.output_event = asyncio.Event()
+        self.queue.wakeup = self.output_event.set
+        writer_task = asyncio.get_running_loop().create_task(self.write_output())
+
+        try:
+            while True:
+                try:
+                    await self.wait_output(lambda: not self.queue.is_full() or self.queue.closed)
+                    received = await self.reader.read(1024)
+                except asyncio.CancelledError:
+                    # server shutdown
+                    return
+                except Exception:
+                    Logger.info('Error reading from the client {}:{}. Closing connection.', self.client_address[0], self.client_address[1])
+                    return
+
+                Logger.debug('Data received {}.', received)
+
+                if len(received) == 0:
+                    Logger.info('Connection from the client {}:{} closed.', self.client_address[0], self.client_address[1])
+                    return
+
+                if not self.process_input(received):
+                    return
+        finally:
+            self.close_session()
+            # the pending output is written before the connection is closed, unless the client does not take it
+            # (or the server shuts down meanwhile, the task is finished regularly then, as its stream callback expects)
+            try:
+                await asyncio.wait([writer_task], timeout=GLOBAL_CONFIG['output_disconnect_timeout'])
+            except asyncio.CancelledError:
+                pass
+            writer_task.cancel()
+            self.writer.close()
+
+class ConfigControl():
+    # changes of the configuration at runtime, applied as copy-on-write snapshots: the changed values are copied and
+    # the whole configuration is replaced by a single assignment, so the readers never see a partial update and need no locks
+    # (the caches of the generators and of the request handlers are keyed by the identity of the values they depend on)
+    lock = threading.RLock()
+
+    # parameters taking effect at the start of the server only
+    static = ['host', 'port', 'server_mode', 'workers', 'metrics_host', 'metrics_port', 'admin_host', 'admin_port', 'record_file', 'replay_file', 'log_level', 'log_format']
+
+    # parameters being dictionaries of integer keys (denoted as strings in JSON), changed item by item
+    keyed = ['equipment', 'sample_data', 'a429_parameters', 'a717_data', 'a429_loopback', 'disc_inputs']
+
+    # the generators and the request handlers rely on valid values and never check them again, so every value is checked
+    # before taking effect (the dictionaries item by item)
+    def is_number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def is_int(value, minimum = None, maximum = None):
+        return isinstance(value, int) and not isinstance(value, bool) and \
+            (minimum == None or value >= minimum) and (maximum == None or value <= maximum)
+
+    def is_positive(value):
+        return ConfigControl.is_number(value) and value > 0
+
+    def is_non_negative(value):
+        return ConfigControl.is_number(value) and value >= 0
+
+    def is_numbers(values):
+        return all([ConfigControl.is_number(value) for value in values])
+
+    def is_channel(channel):
+        if not isinstance(channel, list) or len(channel) < 2:
+            return False
+        owned = len(channel) == 2 or (len(channel) == 3 and channel[2] in ['free', 'owned', 'locked'])
+        if channel[0] == 'a429rx':
+            return len(channel) == 2 and isinstance(channel[1], str)
+        elif channel[0] == 'a429tx':
+            return isinstance(channel[1], str) and owned
+        elif channel[0] == 'a717rx':
+            return len(channel) == 2 and ConfigControl.is_int(channel[1], 1)
+        elif channel[0] == 'disc':
+            return channel[1] == 'in' and len(channel) == 2 or channel[1] == 'out' and owned
+        return False
+
+    def is_waveform(waveform):
+        if not isinstance(waveform, list) or len(waveform) == 0 or not ConfigControl.is_numbers(waveform[1:]):
+            return False
+        if waveform[0] in ['sine', 'ramp', 'step']:
+            return len(waveform) == 4 and waveform[3] > 0
+        elif waveform[0] == 'random_walk':
+            return len(waveform) == 4 and waveform[1] <= waveform[2] and waveform[3] >= 0
+        elif waveform[0] == 'constant':
+            return len(waveform) == 2
+        return False
+
+    def is_parameter(parameter):
+        if not isinstance(parameter, dict) or not ConfigControl.is_waveform(parameter.get('waveform')):
+            return False
+        if not ConfigControl.is_int(parameter.get('sdi', 0), 0, 3) or not ConfigControl.is_int(parameter.get('ssm', 0), 0, 3):
+            return False
+        encoding = parameter.get('encoding', 'bnr')
+        if encoding == 'bnr':
+            return ConfigControl.is_int(parameter.get('bits'), 1, 18) and ConfigControl.is_positive(parameter.get('range'))
+        elif encoding == 'bcd':
+            return ConfigControl.is_int(parameter.get('digits', 5), 1, 5) and ConfigControl.is_positive(parameter.get('resolution', 1))
+        return encoding == 'discrete'
+
+    def is_a717_source(source):
+        if not isinstance(source, list) or len(source) == 0:
+            return False
+        if source[0] == 'constant':
+            return len(source) == 2 and ConfigControl.is_number(source[1])
+        elif source[0] == 'counter':
+            return len(source) == 3 and ConfigControl.is_numbers(source[1:])
+        elif source[0] == 'ramp':
+            return len(source) == 4 and ConfigControl.is_numbers(source[1:]) and source[3] > 0
+        elif source[0] == 'recorded':
+            return len(source) == 2 and isinstance(source[1], list) and len(source[1]) > 0 and ConfigControl.is_numbers(source[1])
+        return False
+
+    def is_disc_pattern(pattern):
+        if not isinstance(pattern, list) or len(pattern) == 0:
+            return False
+        if pattern[0] == 'constant':
+            return len(pattern) == 2 and pattern[1] in [0, 1]
+        elif pattern[0] == 'square':
+            return len(pattern) in [2, 3] and ConfigControl.is_positive(pattern[1]) and \
+                (len(pattern) == 2 or ConfigControl.is_number(pattern[2]) and 0 <= pattern[2] <= 1)
+        elif pattern[0] == 'script':
+            if len(pattern) != 2 or not isinstance(pattern[1], list) or len(pattern[1]) == 0:
+                return False
+            for step in pattern[1]:
+                if not isinstance(step, list) or len(step) != 2 or step[0] not in [0, 1] or not ConfigControl.is_non_negative(step[1]):
+                    return False
+            return sum([duration for state, duration in pattern[1]]) > 0
+        return False
+
+    checks = { \
+        'nl_sequence': lambda value: isinstance(value, str), \
+        'error_codes': lambda value: isinstance(value, bool), \
+        'error_messages': lambda value: isinstance(value, bool), \
+        'stap_version': lambda value: isinstance(value, str), \
+        'max_input_buffer': lambda value: ConfigControl.is_int(value, 1), \
+        'max_transmitex_words': lambda value: ConfigControl.is_int(value, 1), \
+        'data_generator_interval': lambda value: ConfigControl.is_positive(value), \
+        'data_generator_word_delay': lambda value: ConfigControl.is_non_negative(value), \
+        'data_generator_max_lag': lambda value: ConfigControl.is_positive(value), \
+        'min_frequency': lambda value: ConfigControl.is_int(value, 1), \
+        'max_frequency': lambda value: ConfigControl.is_int(value, 1), \
+        'output_flush_size': lambda value: ConfigControl.is_int(value, 1), \
+        'output_flush_latency': lambda value: ConfigControl.is_non_negative(value), \
+        'output_queue_limit': lambda value: ConfigControl.is_int(value, 1), \
+        'output_overflow_policy': lambda value: value in ['drop-oldest', 'drop-newest', 'disconnect'], \
+        'output_disconnect_timeout': lambda value: ConfigControl.is_non_negative(value), \
+        'a429_tx_buffer': lambda value: ConfigControl.is_int(value, 1), \
+        'a429_tx_overflow_policy': lambda value: value in ['drop-oldest', 'reject'], \
+        'a429_tx_interval': lambda value: ConfigControl.is_positive(value), \
+        'replay_speed': lambda value: ConfigControl.is_non_negative(value), \
+        'replay_loop': lambda value: isinstance(value, bool), \
+        'replay_batch': lambda value: ConfigControl.is_int(value, 1), \
+        'record_flush_interval': lambda value: ConfigControl.is_positive(value), \
+        'record_queue_limit': lambda value: ConfigControl.is_int(value, 1), \
+        'workers': lambda value: ConfigControl.is_int(value, 1), \
+        'worker_stats_interval': lambda value: ConfigControl.is_positive(value), \
+        'worker_shutdown_timeout': lambda value: ConfigControl.is_non_negative(value), \
+        'a717_sync_words': lambda value: isinstance(value, list) and len(value) == 4 and all([ConfigControl.is_int(word, 0, 0xfff) for word in value]), \
+        'disc_refresh_interval': lambda value: value == None or ConfigControl.is_positive(value) }
+
+    # checks of the items of the dictionaries, the labels are checked as keys as well
+    item_checks = { \
+        'equipment': lambda value: ConfigControl.is_channel(value), \
+        'sample_data': lambda value: ConfigControl.is_int(value, 0, 0x7fffff), \
+        'a429_parameters': lambda value: ConfigControl.is_parameter(value), \
+        'a717_data': lambda value: ConfigControl.is_a717_source(value), \
+        'a429_loopback': lambda value: isinstance(value, list) and all([ConfigControl.is_int(rx_id) for rx_id in value]), \
+        'disc_inputs': lambda value: ConfigControl.is_disc_pattern(value) }
+    labelled = ['sample_data', 'a429_parameters']
+
+    def check(key, value):
+        # raises ValueError if the value is not valid for the parameter
+        if key in ConfigControl.item_checks:
+            if not isinstance(value, dict):
+                raise ValueError('Invalid value of the parameter {}'.format(key))
+            for id, item in value.items():
+                if not ConfigControl.item_checks[key](item) or (key in ConfigControl.labelled and not ConfigControl.is_int(id, 0, 0o377)):
+                    raise ValueError('Invalid item {} of the parameter {}'.format(id, key))
+        elif key in ConfigControl.checks and not ConfigControl.checks[key](value):
+            raise ValueError('Invalid value of the parameter {}'.format(key))
+
+    def convert(config_data):
+        # the integer keys of the JSON objects are restored
+        result = dict(config_data)
+        for key in ConfigControl.keyed:
+            if key in result:
+                if not isinstance(result[key], dict):
+                    raise ValueError('Invalid value of the parameter {}'.format(key))
+                result[key] = { int(id): value for id, value in result[key].items() }
+        if 'a429_loopback' in result:
+            result['a429_loopback'] = { id: ([int(rx_id) for rx_id in value] if value != None else None) for id, value in result['a429_loopback'].items() }
+        return result
+
+    def replace(values):
+        global GLOBAL_CONFIG
+        with ConfigControl.lock:
+            snapshot = dict(GLOBAL_CONFIG)
+            snapshot.update(values)
+            GLOBAL_CONFIG = snapshot
+
+    def apply(changes):
+        # the items of the dictionaries are merged with the current ones (null removes an item), other values are replaced,
+        # raises ValueError if the changes are not applicable, returns the changed parameters
+        changes = ConfigControl.convert(changes)
+        with ConfigControl.lock:
+            values = ConfigControl.merge(changes)
+            ConfigControl.replace(values)
+        Logger.info('Configuration changed: {}.', ', '.join(values))
+        return list(values)
+
+    def merge(changes):
+        values = dict()
+        for key, value in changes.items():
+            if key not in GLOBAL_CONFIG:
+                raise ValueError('Unknown parameter {}'.format(key))
+            if key in ConfigControl.static:
+                raise ValueError('Parameter {} cannot be changed at runtime'.format(key))
+            if key in ConfigControl.keyed:
+                merged = dict(GLOBAL_CONFIG[key])
+                for id, item in value.items():
+                    if item == None:
+                        merged.pop(id, None)
+                    else:
+                        merged[id] = item
+                value = merged
+            ConfigControl.check(key, value)
+            values[key] = value
+
+        if values.get('min_frequency', GLOBAL_CONFIG['min_frequency']) > values.get('max_frequency', GLOBAL_CONFIG['max_frequency']):
+            raise ValueError('Parameter min_frequency exceeds max_frequency')
+
+        # the subscriptions of the clients stay valid, so no channel may vanish or change its type
+        if 'equipment' in values:
+            for ch_id, channel in GLOBAL_CONFIG['equipment'].items():
+                if ch_id not in values['equipment'] or values['equipment'][ch_id][0] != channel[0]:
+                    raise ValueError('Channel {} cannot be removed or change its type at runtime'.format(ch_id))
+        return values
+
+class LocalHTTPHandler(http.server.BaseHTTPRequestHandler):
+    # base of the local HTTP interfaces, served on ports of their own, by threads of their own
+    def send_body(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        Logger.debug('HTTP request from {}: {}', self.client_address[0], format % args)
+
+    def serve(handler, host_key, port_key, target):
+        # returns None if the port is not configured
+        if GLOBAL_CONFIG[port_key] == None:
+            return None
+        try:
+            server = http.server.ThreadingHTTPServer((GLOBAL_CONFIG[host_key], GLOBAL_CONFIG[port_key]), handler)
+        except Exception as ex:
+            Logger.error('Failed to serve {} on {}:{} due to {}.', handler.__name__, GLOBAL_CONFIG[host_key], GLOBAL_CONFIG[port_key], str(ex))
+            return None
+        server.stap_server = target
+        server_thread = threading.Thread(target=server.serve_forever, name=handler.__name__)
+        server_thread.daemon = True
+        server_thread.start()
+        Logger.info('Serving {} on {}:{}.', handler.__name__, GLOBAL_CONFIG[host_key], GLOBAL_CONFIG[port_key])
+        return server
+
+class MetricsHTTPHandler(LocalHTTPHandler):
+    # the metrics of the server in the Prometheus text format
+    def do_GET(self):
+        if self.path not in ['/', '/metrics']:
+            self.send_error(404)
+            return
+        self.send_body(200, 'text/plain; version=0.0.4; charset=utf-8', Metrics.format_prometheus(self.server.stap_server))
+
+class AdminHTTPHandler(LocalHTTPHandler):
+    # the current configuration (GET /config) and changes of it (POST /config with a JSON object of the changed parameters)
+    def do_GET(self):
+        if self.path != '/config':
+            self.send_error(404)
+            return
+        self.send_body(200, 'application/json', json.dumps(GLOBAL_CONFIG, indent=4).encode('utf-8'))
+
+    def do_POST(self):
+        if self.path != '/config':
+            self.send_error(404)
+            return
+        try:
+            changes = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not isinstance(changes, dict):
+                raise ValueError('JSON object expected')
+            changed = self.server.stap_server.apply_config(changes)
+        except Exception as ex:
+            self.send_body(400, 'application/json', json.dumps({ 'error': str(ex) }).encode('utf-8'))
+            return
+        self.send_body(200, 'application/json', json.dumps({ 'changed': changed }).encode('utf-8'))
+
+class STAPServerMixIn():
+    # state shared by all the clients of a server, independent of the serving mode
+    def init_state(self):
+        self.scheduler = DataScheduler()
+        self.clients = set()
+        self.transmitters = dict()
+        self.transmitters_lock = threading.Lock()
+        self.topics = dict()
+        self.topics_lock = threading.Lock()
+        self.channel_states = dict()
+        self.channel_states_lock = threading.Lock()
+
+        # in the replay mode, the recorded trace is the only source of the data
+        self.replay = None
+        if GLOBAL_CONFIG['replay_file'] != None:
+            try:
+                self.replay = TraceReplay(self, GLOBAL_CONFIG['replay_file'])
+                Logger.info('Replaying {} records of the trace {}.', self.replay.count, GLOBAL_CONFIG['replay_file'])
+                self.scheduler.schedule(self.replay, time.monotonic())
+            except Exception as ex:
+                Logger.error('Failed to open the trace {} due to {}. Generating data instead.', GLOBAL_CONFIG['replay_file'], str(ex))
+                self.replay = None
+
+        # the traffic of all the connections is optionally recorded
+        self.recorder = None
+        if GLOBAL_CONFIG['record_file'] != None:
+            try:
+                self.recorder = TrafficRecorder(GLOBAL_CONFIG['record_file'])
+                Logger.info('Recording the traffic to {}.', GLOBAL_CONFIG['record_file'])
+            except Exception as ex:
+                Logger.error('Failed to open the record {} due to {}. Not recording.', GLOBAL_CONFIG['record_file'], str(ex))
+
+        self.metrics_server = LocalHTTPHandler.serve(MetricsHTTPHandler, 'metrics_host', 'metrics_port', self)
+        self.admin_server = LocalHTTPHandler.serve(AdminHTTPHandler, 'admin_host', 'admin_port', self)
+
+    def create(reuse_port = False):
+        # server of the configured serving mode, the workers of the pre-fork mode share the port
+        hostandport = (GLOBAL_CONFIG['host'], GLOBAL_CONFIG['port'])
+        if GLOBAL_CONFIG['server_mode'] == 'asyncio':
+            return AsyncTCPServer(hostandport, AsyncSTAPHandler, reuse_port)
+        return ThreadedTCPServer(hostandport, STAPHandler, reuse_port)
+
+    def get_metrics(self):
+        return Metrics.collect(), len(self.clients)
+
+    def apply_config(self, changes):
+        changed = ConfigControl.apply(changes)
+        if 'disc_inputs' in changed or 'disc_refresh_interval' in changed:
+            # the discrete inputs are evaluated again right away, their next edges may have moved
+            now = time.monotonic()
+            with self.topics_lock:
+                topics = list(self.topics.values())
+            for topic in topics:
+                topic.wake(now)
+        return changed
+
+    def close_state(self):
+        self.scheduler.shutdown()
+        if self.recorder != None:
+            self.recorder.close()
+        for http_server in [self.metrics_server, self.admin_server]:
+            if http_server != None:
+                http_server.shutdown()
+                http_server.server_close()
+
+    def join_topic(self, subscription):
+        # the clients subscribing a channel at the same frequency share one topic
+        if self.replay != None:
+            return
+        key = (subscription.ch_id, subscription.frequency)
+        with self.topics_lock:
+            topic = self.topics.get(key)
+            created = topic == None
+            if created:
+                if GLOBAL_CONFIG['equipment'][subscription.ch_id][0] == 'disc':
+                    topic = DiscreteTopic(self, subscription.ch_id, subscription.frequency)
+                else:
+                    topic = DataTopic(self, subscription.ch_id, subscription.frequency)
+                self.topics[key] = topic
+            topic.members.add(subscription)
+        if created:
+            self.scheduler.schedule(topic, topic.get_first_deadline(time.monotonic()))
+        else:
+            # the new member of a discrete input is told the current state right away
+            topic.wake(time.monotonic() + GLOBAL_CONFIG['data_generator_word_delay'])
+
+    def leave_topic(self, subscription):
+        with self.topics_lock:
+            topic = self.topics.get((subscription.ch_id, subscription.frequency))
+            if topic != None:
+                topic.members.discard(subscription)
+
+    def get_channel_state(self, ch_id):
+        # read-mostly, the table is locked only to add the state of a channel
+        state = self.channel_states.get(ch_id)
+        if state == None:
+            with self.channel_states_lock:
+                state = self.channel_states.get(ch_id)
+                if state == None:
+                    state = ChannelState(GLOBAL_CONFIG['equipment'][ch_id])
+                    self.channel_states[ch_id] = state
+        return state
+
+    def get_transmitter(self, ch_id):
+        with self.transmitters_lock:
+            if ch_id not in self.transmitters:
+                self.transmitters[ch_id] = A429Transmitter(self, ch_id)
+            return self.transmitters[ch_id]
+
+class ThreadedTCPServer(STAPServerMixIn, socketserver.ThreadingMixIn, socketserver.TCPServer):
+    def __init__(self, hostandport, handler, reuse_port = False):
+        self.reuse_port = reuse_port
+        super().__init__(hostandport, handler)
+        self.daemon_threads = True
+        self.init_state()
+
+    def server_bind(self):
+        # set explicitly, socketserver honors allow_reuse_port only since Python 3.11
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def serve_forever(self, *args, **kwargs):
+        scheduler_thread = threading.Thread(target=self.scheduler.run, name='DataScheduler')
+        scheduler_thread.daemon = True
+        scheduler_thread.start()
+        super().serve_forever(*args, **kwargs)
+
+    def shutdown(self, timeout = None):
+        # the connections are given the timeout to write their remaining output and finish, they are dropped without one
+        super().shutdown()
+        if timeout != None:
+            self.close_clients(timeout)
+        self.close_state()
+
+    def close_clients(self, timeout):
+        # the connections stop reading, so that their handlers finish like closed by the clients
+        deadline = time.monotonic() + timeout
+        handlers = list(self.clients)
+        for handler in handlers:
+            handler.stop_reading()
+        for handler in handlers:
+            handler.thread.join(max(deadline - time.monotonic(), 0))
+
+class AsyncTCPServer(STAPServerMixIn):
+    # single event loop serving all clients, mimics the interface of the socketserver based server
+    def __init__(self, hostandport, handler, reuse_port = False):
+        self.handler = handler
+        self.init_state()
+        self.stopped = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle_client, hostandport[0], hostandport[1], reuse_port=reuse_port))
+
+    def handle_client(self, reader, writer):
+        return self.handler(reader, writer, self).handle()
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.create_task(self.scheduler.run_async())
+        try:
+            self.loop.run_forever()
+        finally:
+            self.stopped.set()
+
+    def shutdown(self, timeout = None):
+        # the connections write their remaining output when the event loop is closed
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.stopped.wait()
+        self.close_state()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.server.close()
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+class Supervisor():
+    # parent process of the pre-fork mode, the workers are processes serving the same port (SO_REUSEPORT),
+    # each with a server of its own, they report their metrics through pipes and are shut down by SIGINT or SIGTERM of the parent
+    # (the workers are forked by a fork server started as a new program, never by the parent running the threads of the logging
+    # and the HTTP interfaces, so they start with the configuration of the parent handed over)
+    def __init__(self):
+        self.context = multiprocessing.get_context('forkserver')
+        self.workers = dict()
+        self.snapshots = dict()
+        self.retired = Metrics()
+        self.should_run = True
+
+    def start_process(index, config, connection):
+        code = 0
+        try:
+            ConfigControl.replace(config)
+            Supervisor.run_worker(index, connection)
+        except Exception as ex:
+            Logger.error('Worker {} failed due to {}.', index, str(ex))
+            code = 1
+        finally:
+            Logger.shutdown()
+        sys.exit(code)
+
+    def run_worker(index, connection):
+        # the worker stops on SIGTERM of the parent, SIGINT of the terminal is left to the parent,
+        # changes of the configuration are received from the parent
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        threading.current_thread().name = 'Worker-{}'.format(index)
+
+        # the parent serves the metrics of all the workers and the admin interface, each worker records to a file of its own
+        values = { 'metrics_port': None, 'admin_port': None }
+        if GLOBAL_CONFIG['record_file'] != None:
+            values['record_file'] = '{}.{}'.format(GLOBAL_CONFIG['record_file'], index)
+        ConfigControl.replace(values)
+        Logger.configure()
+
+        server = STAPServerMixIn.create(True)
+        with server:
+            server_thread = threading.Thread(target=server.serve_forever)
+            server_thread.daemon = True
+            server_thread.start()
+            while not stop.is_set():
+                if connection.poll(GLOBAL_CONFIG['worker_stats_interval']):
+                    server.apply_config(connection.recv())
+                connection.send(server.get_metrics())
+            # the parent may have asked to stop up to one report interval ago
+            server.shutdown(max(GLOBAL_CONFIG['worker_shutdown_timeout'] - GLOBAL_CONFIG['worker_stats_interval'], 0))
+            connection.send(server.get_metrics())
+
+    def start_worker(self, index):
+        connection, worker_connection = self.context.Pipe()
+        with ConfigControl.lock:
+            process = self.context.Process(target=Supervisor.start_process, args=(index, GLOBAL_CONFIG, worker_connection), name='Worker-{}'.format(index))
+            process.start()
+        worker_connection.close()
+        self.workers[index] = (process, connection, time.monotonic())
+        Logger.info('Worker {} started as the process {}.', index, process.pid)
+
+    def apply_config(self, changes):
+        # the changes are validated and applied by the parent first, so that restarted workers inherit them
+        with ConfigControl.lock:
+            changed = ConfigControl.apply(changes)
+            for process, connection, started in list(self.workers.values()):
+                try:
+                    connection.send(changes)
+                except OSError:
+                    pass
+        return changed
+
+    def get_metrics(self):
+        metrics = Metrics()
+        metrics.merge(self.retired)
+        clients = 0
+        for worker_metrics, worker_clients in list(self.snapshots.values()):
+            metrics.merge(worker_metrics)
+            clients += worker_clients
+        return metrics, clients
+
+    def receive(self, timeout):
+        # the latest metrics of each worker are kept
+        connections = { connection: index for index, (process, connection, started) in self.workers.items() }
+        for connection in multiprocessing.connection.wait(list(connections), timeout):
+            try:
+                self.snapshots[connections[connection]] = connection.recv()
+            except (EOFError, OSError):
+                pass
+
+    def reap(self):
+        # returns the indexes of the exited workers, their last metrics are kept in the totals
+        exited = []
+        for index, (process, connection, started) in list(self.workers.items()):
+            if not process.is_alive():
+                del self.workers[index]
+                connection.close()
+                snapshot = self.snapshots.pop(index, None)
+                if snapshot != None:
+                    self.retired.merge(snapshot[0])
+                exited.append((index, started))
+        return exited
+
+    def stop(self, signum, frame):
+        self.should_run = False
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        for index in range(GLOBAL_CONFIG['workers']):
+            self.start_worker(index)
+        http_servers = [LocalHTTPHandler.serve(MetricsHTTPHandler, 'metrics_host', 'metrics_port', self), LocalHTTPHandler.serve(AdminHTTPHandler, 'admin_host', 'admin_port', self)]
+
+        # crashed workers are restarted, unless they fail right at their start (e.g. the port is not available)
+        while self.should_run:
+            self.receive(0.5)
+            for index, started in self.reap():
+                if time.monotonic() - started < 1.0:
+                    Logger.error('Worker {} exited right after its start. Shutting down.', index)
+                    self.should_run = False
+                elif self.should_run:
+                    Logger.error('Worker {} exited unexpectedly. Restarting it.', index)
+                    self.start_worker(index)
+
+        # the workers finish their connections and report their final metrics, unless they take too long
+        Logger.info('Shutting down {} workers.', len(self.workers))
+        for process, connection, started in self.workers.values():
+            process.terminate()
+        deadline = time.monotonic() + GLOBAL_CONFIG['worker_shutdown_timeout']
+        while len(self.workers) > 0 and time.monotonic() < deadline:
+            self.receive(0.1)
+            self.reap()
+        for process, connection, started in self.workers.values():
+            Logger.error('Worker process {} did not stop in time. Killing it.', process.pid)
+            process.kill()
+            process.join()
+
+        for http_server in http_servers:
+            if http_server != None:
+                http_server.shutdown()
+                http_server.server_close()
+        metrics, clients = self.get_metrics()
+        Logger.info('All workers stopped after {} connections, {} bytes received and {} bytes sent.', metrics.counters['connections'], metrics.counters['received'], metrics.counters['sent'])
+
+if __name__ == "__main__":
+    # the logging is configured again once the configuration is loaded
+    Logger.configure()
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'r') as config_file:
+            try:
+                config_data = ConfigControl.convert(json.load(config_file))
+                for key, value in config_data.items():
+                    try:
+                        ConfigControl.check(key, value)
+                        GLOBAL_CONFIG[key] = value
+                    except ValueError as ex:
+                        Logger.error('{} in the config file {}. Falling back to the default.', str(ex), sys.argv[1])
+            except Exception as ex:
+                Logger.error('Failed to load the config file {} due to {}. Falling back to defaults.', sys.argv[1], str(ex))
+                
+    Logger.configure()
+    print(json.dumps(GLOBAL_CONFIG, indent=4))
+
+    Logger.info('Staring STAP server on {}:{}...', GLOBAL_CONFIG['host'], GLOBAL_CONFIG['port'])
+
+    if GLOBAL_CONFIG['workers'] > 1 and not ('forkserver' in multiprocessing.get_all_start_methods() and hasattr(socket, 'SO_REUSEPORT')):
+        Logger.error('The pre-fork mode is not supported by the platform. Serving by a single process.')
+        GLOBAL_CONFIG['workers'] = 1
+
+    if GLOBAL_CONFIG['workers'] > 1:
+        Supervisor().run()
+        Logger.shutdown()
+    else:
+        with STAPServerMixIn.create() as server:
+            server_thread = threading.Thread(target=server.serve_forever)
+            server_thread.daemon = True
+            server_thread.start()
 
-        text = input('Press enter to exit the main loop...')
-        server.shutdown()
-        Logger.info('Server shutdown has been called.')
+            text = input('Press enter to exit the main loop...')
+            server.shutdown()
+            Logger.info('Server shutdown has been called.')
+            Logger.shutdown()